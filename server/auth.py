@@ -7,24 +7,20 @@ from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 from bson import ObjectId
-import pymongo
 import re
 import os
-from dotenv import load_dotenv
-
-load_dotenv()
+from db import get_collection
+from tracing import span, tag_user
 
 router = APIRouter(prefix="/auth", tags=["Auth"])
 
 # ----------------- MongoDB -----------------
-client = pymongo.MongoClient(os.getenv("MONGO_URI"))
-db = client["influencer_db"]
-users = db["users"]
-
-# Optional: ensure uniqueness at DB level
-# (runs once; harmless if indexes already exist)
-users.create_index("email", unique=True)
-users.create_index("username", unique=True)
+# email/username unique indexes are managed by db.ensure_indexes()
+def get_users():
+    users = get_collection("users")
+    if users is None:
+        raise HTTPException(status_code=503, detail="Database not configured")
+    return users
 
 # ----------------- JWT -----------------
 ACCESS_SECRET = os.getenv("ACCESS_SECRET", os.getenv("SECRET_KEY", "access_secret"))
@@ -33,7 +29,11 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
 REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", 7))
 
+# users with role="admin" on their doc, or listed here, may see every user's data
+ADMIN_EMAILS = {e.strip().lower() for e in os.getenv("ADMIN_EMAILS", "").split(",") if e.strip()}
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")  # used for access token
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login", auto_error=False)
 
 # ----------------- Password hashing -----------------
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -42,7 +42,8 @@ def hash_password(password: str) -> str:
     return pwd_context.hash(password)
 
 def verify_password(plain: str, hashed: str) -> bool:
-    return pwd_context.verify(plain, hashed)
+    with span("auth.verify_password"):
+        return pwd_context.verify(plain, hashed)
 
 # ----------------- Helpers -----------------
 def is_strong_password(password: str) -> bool:
@@ -73,13 +74,16 @@ def create_refresh_token(sub: str) -> str:
     return jwt.encode(payload, REFRESH_SECRET, algorithm=ALGORITHM)
 
 def get_user_by_email(email: str):
-    return users.find_one({"email": email})
+    with span("mongo.user_lookup", by="email"):
+        return get_users().find_one({"email": email})
 
 def get_user_by_id(user_id: str):
-    try:
-        return users.find_one({"_id": ObjectId(user_id)})
-    except Exception:
-        return None
+    users = get_users()
+    with span("mongo.user_lookup", by="id"):
+        try:
+            return users.find_one({"_id": ObjectId(user_id)})
+        except Exception:
+            return None
 
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     # Access-token protected dependency (like @jwt_required())
@@ -93,10 +97,30 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         user = get_user_by_id(uid)
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
+        tag_user(uid)
         return user
     except JWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired token")
 
+def get_optional_user_id(token: str | None = Depends(optional_oauth2_scheme)) -> str | None:
+    # Cheap identity for rate limiting: user id from a valid access token, no DB lookup
+    if not token:
+        return None
+    try:
+        payload = jwt.decode(token, ACCESS_SECRET, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    if payload.get("typ") != "access":
+        return None
+    tag_user(payload.get("sub"))
+    return payload.get("sub")
+
+def has_role(user: dict, *roles: str) -> bool:
+    # `role` on the user doc; ADMIN_EMAILS grants admin without editing the doc
+    if user.get("role") in roles:
+        return True
+    return "admin" in roles and (user.get("email") or "").lower() in ADMIN_EMAILS
+
 # ----------------- Schemas -----------------
 class RegisterIn(BaseModel):
     username: str = Field(..., min_length=3)
@@ -132,7 +156,7 @@ def register(data: RegisterIn):
     if get_user_by_email(data.email):
         # 409 in Flask for "exists"; we'll mirror that
         raise HTTPException(status_code=409, detail="Email already exists")
-    if users.find_one({"username": data.username}):
+    if get_users().find_one({"username": data.username}):
         raise HTTPException(status_code=409, detail="Username already exists")
     if data.password != data.confirm_password:
         raise HTTPException(status_code=400, detail="Passwords do not match")
@@ -149,7 +173,7 @@ def register(data: RegisterIn):
         "last_name": data.last_name,
         "password": hash_password(data.password),
     }
-    result = users.insert_one(doc)
+    result = get_users().insert_one(doc)
     # After creating user, issue tokens (same shape as /login)
     uid = str(result.inserted_id)
     access_token = create_access_token(uid)
@@ -228,12 +252,12 @@ async def update_user(data: UpdateIn, current_user = Depends(get_current_user)):
 
     # username/email uniqueness checks (excluding current user)
     if data.username and data.username != current_user["username"]:
-        if users.find_one({"username": data.username, "_id": {"$ne": uid}}):
+        if get_users().find_one({"username": data.username, "_id": {"$ne": uid}}):
             raise HTTPException(status_code=409, detail="Username already taken")
         updates["username"] = data.username
 
     if data.email and data.email != current_user["email"]:
-        if users.find_one({"email": data.email, "_id": {"$ne": uid}}):
+        if get_users().find_one({"email": data.email, "_id": {"$ne": uid}}):
             raise HTTPException(status_code=409, detail="Email already taken")
         updates["email"] = data.email
 
@@ -254,11 +278,11 @@ async def update_user(data: UpdateIn, current_user = Depends(get_current_user)):
         updates["password"] = hash_password(data.new_password)
 
     if updates:
-        users.update_one({"_id": uid}, {"$set": updates})
+        get_users().update_one({"_id": uid}, {"$set": updates})
 
     return {"message": "Profile updated successfully"}
 
 @router.delete("/user")
 async def delete_user(current_user = Depends(get_current_user)):
-    users.delete_one({"_id": current_user["_id"]})
+    get_users().delete_one({"_id": current_user["_id"]})
     return {"message": "Account deleted"}
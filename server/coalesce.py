@@ -0,0 +1,162 @@
+# coalesce.py — collapse concurrent identical work into one upstream execution
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable
+
+from pymongo.errors import DuplicateKeyError
+
+from db import get_collection
+from deadline import DeadlineExceeded, wait_timeout
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    """
+    In-process request coalescing: the first caller for a key (the leader) runs
+    `fn`; concurrent callers with the same key wait for and share its outcome.
+    """
+
+    def __init__(self):
+        self._calls: dict[str, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[Callable], Any]) -> tuple[Any, bool]:
+        """
+        Return (value, leader). Followers re-raise the leader's exception, and
+        raise DeadlineExceeded if their request deadline ends first.
+        `fn` receives a `hold(interim=None)` callable: calling it keeps the key
+        registered past fn's return (later callers get the same value instead of
+        re-running the work) and hands back the release function. In-process
+        followers already share fn's return value, so `interim` is not needed here.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            if not call.done.wait(wait_timeout()):
+                raise DeadlineExceeded("request deadline reached waiting for an identical request")
+            if call.error is not None:
+                raise call.error
+            return call.value, False
+
+        held = {"detached": False}
+
+        def release():
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+
+        def hold(interim=None):
+            held["detached"] = True
+            return release
+
+        try:
+            call.value = fn(hold)
+            return call.value, True
+        except BaseException as e:
+            call.error = e
+            held["detached"] = False
+            raise
+        finally:
+            if not held["detached"]:
+                release()
+            call.done.set()
+
+
+class MongoLease:
+    """
+    Cross-worker coalescing through a lease document (_id = key). The holder runs
+    the work; other workers poll for its published result until the lease is
+    released or expires, then take over if nothing was published.
+    """
+
+    def __init__(self, collection: str, ttl_seconds: int = 300, poll_interval: float = 0.5):
+        self.collection = collection
+        self.ttl = ttl_seconds
+        self.poll_interval = poll_interval
+
+    def _acquire(self, leases, key: str, owner: str) -> bool:
+        now = datetime.utcnow()
+        # clear an expired lease left by a crashed worker (TTL cleanup is lazy)
+        leases.delete_one({"_id": key, "expires_at": {"$lt": now}})
+        try:
+            leases.insert_one({"_id": key, "owner": owner, "expires_at": now + timedelta(seconds=self.ttl)})
+            return True
+        except DuplicateKeyError:
+            return False
+
+    def run(self, key: str, fn: Callable[[Callable | None], Any], poll: Callable[[], Any], timeout: float) -> tuple[Any, bool]:
+        """
+        Return (value, leader). `poll` returns the published result or None.
+        After `timeout` seconds of waiting the caller runs `fn` itself.
+        `fn` receives a `hold(interim=None)` callable: calling it keeps the lease past
+        fn's return and hands back the release function (for work that finishes in
+        the background). `interim` is stored on the lease, and waiting workers return
+        it when `poll` has nothing yet, so they see the partial result too.
+        """
+        leases = get_collection(self.collection)
+        if leases is None:
+            return fn(None), True
+        owner = uuid.uuid4().hex
+        # never wait past the request deadline; that ends in DeadlineExceeded, not a takeover
+        wait = wait_timeout(timeout)
+        deadline = time.monotonic() + wait
+        while True:
+            try:
+                acquired = self._acquire(leases, key, owner)
+            except Exception as e:
+                print("coalescing lease error:", e)
+                return fn(None), True
+            if acquired:
+                held = {"detached": False}
+
+                def release():
+                    try:
+                        leases.delete_one({"_id": key, "owner": owner})
+                    except Exception as e:
+                        print("coalescing lease release error:", e)
+
+                def hold(interim=None):
+                    held["detached"] = True
+                    if interim is not None:
+                        try:
+                            leases.update_one({"_id": key, "owner": owner}, {"$set": {"interim": interim}})
+                        except Exception as e:
+                            print("coalescing lease publish error:", e)
+                    return release
+
+                try:
+                    return fn(hold), True
+                finally:
+                    if not held["detached"]:
+                        release()
+            # another worker is leading: wait for its result or for the lease to go away
+            while time.monotonic() < deadline:
+                time.sleep(max(0.0, min(self.poll_interval, deadline - time.monotonic())))
+                value = poll()
+                if value is not None:
+                    return value, False
+                lease = leases.find_one({"_id": key, "expires_at": {"$gte": datetime.utcnow()}}, {"interim": 1})
+                if lease is None:
+                    # released between our poll and this check, or the leader failed/died
+                    value = poll()
+                    if value is not None:
+                        return value, False
+                    break
+                if lease.get("interim") is not None:
+                    # the leader returned a partial result and is finishing it in the background
+                    return lease["interim"], False
+            else:
+                if wait < timeout:
+                    raise DeadlineExceeded("request deadline reached waiting for another worker's request")
+                return fn(None), True
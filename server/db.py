@@ -1,4 +1,5 @@
 import os
+import threading
 from dotenv import load_dotenv
 from datetime import datetime
 try:
@@ -7,28 +8,119 @@ except Exception as e:
     pymongo = None
     print("pymongo not available:", e)
 
+# .env is loaded once, here; other modules import db before reading config
 load_dotenv()
 
 MONGO_URI = os.getenv("MONGO_URI")
+DB_NAME = "influencer_db"
+# keep startup/readiness snappy when Mongo is unreachable
+MONGO_TIMEOUT_MS = int(os.getenv("MONGO_TIMEOUT_MS", 5000))
 
-client = None
-db = None
-users_collection = None
-searches_collection = None
+# Nothing connects at import time: the client is created on first use and
+# indexes are managed once by ensure_indexes() (lifespan hook or `python db.py`).
+_client = None
+_lock = threading.Lock()
+_indexes_ready = False
 
-if pymongo and MONGO_URI:
+# name -> list of (keys, create_index kwargs)
+INDEXES = {
+    "users": [
+        ("email", {"unique": True}),
+        ("username", {"unique": True}),
+    ],
+    # TTL for cached searches (default 24h). adjust expireAfterSeconds as needed.
+    # last_hit_at: cache warming scans the most recently hit searches first
+    "searches": [("created_at", {"expireAfterSeconds": 60 * 60 * 24}), ("last_hit_at", {})],
+    # one document per influencer (_id = str(pk)); outlives any search referencing it
+    "influencers": [("updated_at", {"expireAfterSeconds": 60 * 60 * 48})],
+    # shared per-user request counters (only used when QUOTA_BACKEND=mongo)
+    "quotas": [("expires_at", {"expireAfterSeconds": 0})],
+    # follower crawls: one state doc per account + packed id pages
+    "follower_pages": [([("crawl_id", 1), ("page", 1)], {"unique": True})],
+    # cross-worker search coalescing leases
+    "search_leases": [("expires_at", {"expireAfterSeconds": 0})],
+    # cache warmer coordination: leader lease, shared budget buckets, worker usage reports
+    "cache_warming": [("expires_at", {"expireAfterSeconds": 0})],
+    # remembered upstream failures (only used when NEGATIVE_CACHE_BACKEND=mongo)
+    "negative_cache": [("expires_at", {"expireAfterSeconds": 0}), ("pk", {})],
+}
+
+
+def get_client():
+    """Shared MongoClient, created lazily. None when Mongo is not configured."""
+    global _client
+    if _client is not None or not (pymongo and MONGO_URI):
+        return _client
+    with _lock:
+        if _client is None:
+            try:
+                # MongoClient connects in the background; this does not block
+                _client = pymongo.MongoClient(MONGO_URI, serverSelectionTimeoutMS=MONGO_TIMEOUT_MS)
+            except Exception as e:
+                print("mongodb connection error:", e)
+    return _client
+
+
+def get_db():
+    client = get_client()
+    return client[DB_NAME] if client is not None else None
+
+
+def get_collection(name: str):
+    """Collection handle, or None when Mongo is not configured (caching disabled)."""
+    database = get_db()
+    return database[name] if database is not None else None
+
+
+def ensure_indexes() -> bool:
+    """Create all indexes once per process. Returns True when they are in place."""
+    global _indexes_ready
+    if _indexes_ready:
+        return True
+    database = get_db()
+    if database is None:
+        print("mongodb not configured; caching disabled")
+        return False
+    ok = True
+    for name, specs in INDEXES.items():
+        for keys, kwargs in specs:
+            try:
+                database[name].create_index(keys, **kwargs)
+            except Exception as e:
+                ok = False
+                print(f"could not create index {keys} on {name}:", e)
+    _indexes_ready = ok
+    if ok:
+        print("mongodb connected (indexes ready)")
+    return ok
+
+
+def indexes_ready() -> bool:
+    return _indexes_ready
+
+
+def ping() -> bool:
+    client = get_client()
+    if client is None:
+        return False
     try:
-        client = pymongo.MongoClient(MONGO_URI)
-        db = client["influencer_db"]
-        users_collection = db["users"]
-        searches_collection = db["searches"]
-        # create TTL index for cached searches (default 24h). adjust expireAfterSeconds as needed.
-        try:
-            searches_collection.create_index("created_at", expireAfterSeconds=60 * 60 * 24)
-        except Exception as e:
-            print("could not create TTL index on searches:", e)
-        print("mongodb connected (db ready)")
+        client.admin.command("ping")
+        return True
     except Exception as e:
-        print("mongodb connection error:", e)
-else:
-    print("mongodb not configured; caching disabled")
\ No newline at end of file
+        print("mongodb ping failed:", e)
+        return False
+
+
+def close():
+    global _client, _indexes_ready
+    with _lock:
+        if _client is not None:
+            _client.close()
+        _client = None
+        _indexes_ready = False
+
+
+if __name__ == "__main__":
+    # one-off index management for deployments running many workers
+    # (set MONGO_MANAGE_INDEXES=0 for the workers themselves)
+    raise SystemExit(0 if ensure_indexes() else 1)
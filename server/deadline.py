@@ -0,0 +1,83 @@
+# deadline.py — request-level deadlines propagated to upstream calls
+#
+# A deadline is set once per request (deadline_scope) and read implicitly by
+# rapid_get and the pacing sleeps via a context variable, so helpers such as
+# get_insights / fetch_rapid_follower_profile need no extra parameters.
+# Threads started without copying the context (background enrichment) run
+# without a deadline.
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from tracing import span
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+_current: ContextVar[Deadline | None] = ContextVar("deadline", default=None)
+
+
+def current_deadline() -> Deadline | None:
+    return _current.get()
+
+
+def deadline_expired() -> bool:
+    d = _current.get()
+    return d is not None and d.expired()
+
+
+@contextmanager
+def deadline_scope(seconds: float | None):
+    """Run the block under a deadline of `seconds` (None or <= 0: no deadline)."""
+    token = _current.set(Deadline(seconds) if seconds and seconds > 0 else None)
+    try:
+        yield _current.get()
+    finally:
+        _current.reset(token)
+
+
+def clamp_timeout(timeout: float) -> float:
+    """Upstream timeout bounded by the remaining deadline; raises DeadlineExceeded when spent."""
+    d = _current.get()
+    if d is None:
+        return timeout
+    remaining = d.remaining()
+    if remaining <= 0:
+        raise DeadlineExceeded(f"request deadline of {d.seconds}s exceeded")
+    return min(timeout, remaining)
+
+
+def wait_timeout(timeout: float | None = None) -> float | None:
+    """
+    Bound for a blocking wait (lock, event, poll loop): `timeout` capped by the
+    remaining deadline; None means wait indefinitely. Raises DeadlineExceeded when spent.
+    """
+    d = _current.get()
+    if d is None:
+        return timeout
+    return clamp_timeout(d.remaining() if timeout is None else timeout)
+
+
+def pace(seconds: float):
+    """Deliberate pacing sleep, cut short so it never outlives the deadline."""
+    d = _current.get()
+    if d is not None:
+        seconds = min(seconds, max(0.0, d.remaining()))
+    if seconds > 0:
+        with span("sleep", seconds=round(seconds, 3)):
+            time.sleep(seconds)
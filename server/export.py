@@ -0,0 +1,157 @@
+# export.py — streaming CSV / NDJSON export of cached searches and influencers
+#
+# Rows are read from a Mongo cursor in batches and written out by a generator,
+# so memory stays flat regardless of export size and the first rows are sent
+# as soon as the first batch arrives. De-duplication of influencers across
+# searches happens server-side in an aggregation pipeline.
+
+import csv
+import io
+from datetime import datetime
+from typing import Iterable, Iterator, Literal
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+from auth import get_current_user, has_role
+from db import get_collection
+from quotas import quota
+from responses import dumps
+
+router = APIRouter()
+
+SEARCH_COLUMNS = ["keyword", "keyword_raw", "limit", "user_id", "count", "hits", "created_at", "last_hit_at", "pks"]
+INFLUENCER_COLUMNS = [
+    "pk", "username", "full_name", "followers", "total_posts", "post_count", "avg_likes",
+    "engagement", "engagement_rate_percent", "bio", "profile_pic", "keywords", "updated_at",
+]
+# flush to the client every ~32 KB
+FLUSH_BYTES = 32 * 1024
+
+
+def _search_filter(keyword: str | None, user_id: str | None, since: datetime | None, until: datetime | None) -> dict:
+    query: dict = {}
+    if keyword:
+        query["keyword"] = keyword.strip().lower()
+    if user_id:
+        query["user_id"] = str(user_id)
+    if since or until:
+        query["created_at"] = {}
+        if since:
+            query["created_at"]["$gte"] = since
+        if until:
+            query["created_at"]["$lt"] = until
+    return query
+
+
+def _searches_cursor(query: dict, batch_size: int):
+    projection = {"_id": 0, **{c: 1 for c in SEARCH_COLUMNS}}
+    return get_collection("searches").find(query, projection).sort("created_at", -1).batch_size(batch_size)
+
+
+def _influencers_cursor(query: dict, search_scoped: bool, batch_size: int):
+    if not search_scoped:
+        # no search filters: stream the influencer collection directly (date range on updated_at)
+        if "created_at" in query:
+            query = {"updated_at": query["created_at"]}
+        return get_collection("influencers").find(query, {"_id": 0}).sort("_id", 1).batch_size(batch_size)
+    pipeline = [
+        {"$match": query},
+        {"$project": {"pks": 1, "keyword": 1}},
+        {"$unwind": "$pks"},
+        {"$group": {"_id": "$pks", "keywords": {"$addToSet": "$keyword"}}},
+        # order the small {pk, keywords} docs here; the joins below then stream in that order
+        {"$sort": {"_id": 1}},
+        {"$lookup": {"from": "influencers", "localField": "_id", "foreignField": "_id", "as": "profile"}},
+        {"$unwind": "$profile"},
+        {"$replaceRoot": {"newRoot": {"$mergeObjects": ["$profile", {"keywords": "$keywords"}]}}},
+        {"$project": {"_id": 0}},
+    ]
+    return get_collection("searches").aggregate(pipeline, allowDiskUse=True, batchSize=batch_size)
+
+
+def _csv_value(value):
+    if isinstance(value, list):
+        return ";".join(str(v) for v in value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return "" if value is None else value
+
+
+def _csv_rows(docs: Iterable[dict], columns: list[str]) -> Iterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    for n, doc in enumerate(docs):
+        writer.writerow([_csv_value(doc.get(c)) for c in columns])
+        # send the header + first row right away, then in ~FLUSH_BYTES chunks
+        if n == 0 or buf.tell() >= FLUSH_BYTES:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+def _ndjson_rows(docs: Iterable[dict]) -> Iterator[bytes]:
+    chunk = bytearray()
+    for n, doc in enumerate(docs):
+        chunk += dumps(doc) + b"\n"
+        if n == 0 or len(chunk) >= FLUSH_BYTES:
+            yield bytes(chunk)
+            chunk.clear()
+    if chunk:
+        yield bytes(chunk)
+
+
+def _with_cleanup(rows: Iterator[bytes], cursor) -> Iterator[bytes]:
+    # close the server-side cursor even if the client disconnects mid-export
+    try:
+        yield from rows
+    finally:
+        cursor.close()
+
+
+@router.get("/export", dependencies=[Depends(quota("lookup"))])
+def export(
+    kind: Literal["influencers", "searches"] = "influencers",
+    fmt: Literal["csv", "ndjson"] = Query("ndjson", alias="format"),
+    keyword: str | None = None,
+    user_id: str | None = None,
+    all_users: bool = False,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    batch_size: int = Query(500, ge=10, le=5000),
+    current_user: dict = Depends(get_current_user),
+):
+    """
+    GET /influencers/export?kind=influencers&format=csv&keyword=food&since=2025-01-01
+    Streams cached searches or influencers as CSV or NDJSON.
+    - Exports cover the caller's own searches. Another user_id, or all_users=true,
+      requires an admin or analyst account.
+    - keyword/user_id/since/until filter searches (created_at); influencer exports
+      then contain each creator once with the matching keywords.
+    - With all_users and no keyword/user_id, influencer exports read the influencers
+      collection directly and since/until apply to updated_at.
+    """
+    if get_collection("searches") is None:
+        raise HTTPException(status_code=503, detail="Database not configured")
+    own_id = str(current_user["_id"])
+    if (all_users or (user_id and str(user_id) != own_id)) and not has_role(current_user, "admin", "analyst"):
+        raise HTTPException(status_code=403, detail="Exporting other users' data requires an admin or analyst account")
+    if not all_users:
+        user_id = user_id or own_id
+
+    query = _search_filter(keyword, user_id, since, until)
+    if kind == "searches":
+        cursor, columns = _searches_cursor(query, batch_size), SEARCH_COLUMNS
+    else:
+        cursor, columns = _influencers_cursor(query, bool(keyword or user_id), batch_size), INFLUENCER_COLUMNS
+
+    rows = _csv_rows(cursor, columns) if fmt == "csv" else _ndjson_rows(cursor)
+    filename = f"{kind}-{datetime.utcnow():%Y%m%d%H%M%S}.{fmt}"
+    return StreamingResponse(
+        _with_cleanup(rows, cursor),
+        media_type="text/csv" if fmt == "csv" else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
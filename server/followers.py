@@ -0,0 +1,540 @@
+# followers.py — resumable, cursor-paginated follower crawler
+#
+# Pages come from RapidAPI /followers (cursor = next_max_id). Each page's follower
+# pks are stored as one packed, sorted uint64 array in `follower_pages`, and the
+# crawl state (cursor, page count, status, lease) lives in `follower_crawls`
+# keyed by the account id, so a crawl can resume after a crash or restart.
+# Memory stays constant: only the current page is ever held.
+#
+# Each saved page is merged into the account's 4 KB KMV sketch in
+# `audience_sketches`, which is all /audience/overlap needs at query time.
+
+import os
+import sys
+import threading
+import time
+import uuid
+from array import array
+from datetime import datetime, timedelta
+from typing import Iterator
+
+from bson import Binary
+from fastapi import APIRouter, Depends, HTTPException, Query
+from pydantic import BaseModel, Field
+from fastapi.responses import StreamingResponse
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from auth import get_current_user
+from db import get_collection
+from influencers import rapid_get, RAPIDAPI_HOST, RAPIDAPI_KEY
+from quotas import quota, quota_hit
+from ratelimit import RAPIDAPI_BUDGET
+from responses import dumps
+from sketches import DEFAULT_K, KMVSketch, estimate_overlap
+
+router = APIRouter()
+
+FOLLOWERS_URL = f"https://{RAPIDAPI_HOST}/followers"
+# pause between pages, on top of the budget check below
+FOLLOWER_PAGE_DELAY = float(os.getenv("FOLLOWER_PAGE_DELAY", 1.0))
+# share of the RapidAPI per-minute budget kept free for interactive requests
+FOLLOWER_CRAWL_RESERVE = float(os.getenv("FOLLOWER_CRAWL_RESERVE", 0.5))
+# crawl calls per minute, counted in the quota backend: across all workers with
+# QUOTA_BACKEND=mongo, per worker otherwise
+FOLLOWER_CRAWL_CALLS_PER_MINUTE = max(1, int(RAPIDAPI_BUDGET.limit * (1 - FOLLOWER_CRAWL_RESERVE)))
+# background crawls running at once (across workers when Mongo is configured)
+FOLLOWER_MAX_CRAWLS = int(os.getenv("FOLLOWER_MAX_CRAWLS", 4))
+FOLLOWER_MAX_RETRIES = int(os.getenv("FOLLOWER_MAX_RETRIES", 3))
+LEASE_SECONDS = 120
+SKETCH_K = int(os.getenv("OVERLAP_SKETCH_K", DEFAULT_K))
+# pages per streaming request; full crawls go through POST /followers/crawl
+FOLLOWER_STREAM_PAGES = int(os.getenv("FOLLOWER_STREAM_PAGES", 5))
+FOLLOWER_STREAM_MAX_PAGES = int(os.getenv("FOLLOWER_STREAM_MAX_PAGES", 20))
+# seconds a streaming request waits for crawl budget before returning its cursor
+FOLLOWER_STREAM_BUDGET_WAIT = float(os.getenv("FOLLOWER_STREAM_BUDGET_WAIT", 10))
+
+
+# ----------------- Compact id storage -----------------
+def pack_ids(ids) -> bytes:
+    """Sorted uint64 little-endian array (8 bytes per follower)."""
+    arr = array("Q", sorted(set(int(i) for i in ids)))
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def unpack_ids(data: bytes) -> array:
+    arr = array("Q")
+    arr.frombytes(bytes(data))
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return arr
+
+
+def iter_follower_ids(user_id: str, batch_size: int = 200) -> Iterator[int]:
+    """Stream every stored follower id of `user_id`, one page doc at a time."""
+    pages = get_collection("follower_pages")
+    if pages is None:
+        return
+    cursor = pages.find({"crawl_id": str(user_id)}, {"_id": 0, "ids": 1}).sort("page", 1).batch_size(batch_size)
+    for doc in cursor:
+        yield from unpack_ids(doc["ids"])
+
+
+# ----------------- Crawl state -----------------
+def _acquire_lease(user_id: str, owner: str) -> dict | None:
+    """Take (or create) the crawl doc for `user_id`; None if another crawler holds it."""
+    crawls = get_collection("follower_crawls")
+    if crawls is None:
+        return {}
+    now = datetime.utcnow()
+    try:
+        return crawls.find_one_and_update(
+            {"_id": str(user_id), "$or": [{"lease_until": {"$lt": now}}, {"lease_until": None}]},
+            {
+                "$set": {"lease_owner": owner, "lease_until": now + timedelta(seconds=LEASE_SECONDS), "status": "running", "updated_at": now},
+                "$setOnInsert": {"pages": 0, "count": 0, "next_max_id": None, "started_at": now},
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        return None
+
+
+def _save_page(user_id: str, owner: str, page: int, cursor: str | None, next_max_id: str | None, pks: list) -> bool:
+    """Persist one page and advance the stored cursor; False if the lease was lost."""
+    pages = get_collection("follower_pages")
+    crawls = get_collection("follower_crawls")
+    if pages is None or crawls is None:
+        return True
+    # idempotent per (crawl_id, page): a re-fetched page after a crash overwrites itself
+    pages.replace_one(
+        {"crawl_id": str(user_id), "page": page},
+        {"crawl_id": str(user_id), "page": page, "cursor": cursor, "count": len(pks), "ids": Binary(pack_ids(pks))},
+        upsert=True,
+    )
+    now = datetime.utcnow()
+    res = crawls.update_one(
+        {"_id": str(user_id), "lease_owner": owner},
+        {
+            "$set": {"next_max_id": next_max_id, "pages": page + 1, "updated_at": now, "lease_until": now + timedelta(seconds=LEASE_SECONDS)},
+            "$inc": {"count": len(pks)},
+        },
+    )
+    if res.matched_count != 1:
+        return False
+    try:
+        _merge_into_sketch(user_id, page, pks)
+    except Exception as e:
+        print(f"audience sketch update error for {user_id}: {e}")
+    return True
+
+
+def _finish(user_id: str, owner: str, status: str, error: str | None = None):
+    crawls = get_collection("follower_crawls")
+    if crawls is None:
+        return
+    update = {"status": status, "lease_until": None, "updated_at": datetime.utcnow()}
+    if status == "done":
+        update["finished_at"] = update["updated_at"]
+    if error:
+        update["error"] = error
+    crawls.update_one({"_id": str(user_id), "lease_owner": owner}, {"$set": update})
+
+
+def _reset(user_id: str):
+    """Drop stored pages so a restarted crawl doesn't leave stale tail pages."""
+    pages = get_collection("follower_pages")
+    crawls = get_collection("follower_crawls")
+    if pages is None or crawls is None:
+        return
+    pages.delete_many({"crawl_id": str(user_id)})
+    sketches = get_collection("audience_sketches")
+    if sketches is not None:
+        sketches.delete_one({"_id": str(user_id)})
+    crawls.update_one({"_id": str(user_id)}, {"$set": {"pages": 0, "count": 0, "next_max_id": None}, "$unset": {"error": "", "finished_at": ""}})
+
+
+def get_crawl(user_id: str) -> dict | None:
+    crawls = get_collection("follower_crawls")
+    if crawls is None:
+        return None
+    return crawls.find_one({"_id": str(user_id)}, {"lease_owner": 0})
+
+
+# ----------------- Audience sketches -----------------
+def build_audience_sketch(user_id: str) -> KMVSketch | None:
+    """(Re)build the follower sketch from stored pages; streams ids, O(k) memory, O(n) time."""
+    sketches = get_collection("audience_sketches")
+    if sketches is None:
+        return None
+    crawl = get_crawl(user_id) or {}
+    # read the page count first: pages saved during the rebuild may or may not be
+    # included, so the stored count stays a lower bound and later merges catch up
+    sketch = KMVSketch.from_ids(iter_follower_ids(user_id), k=SKETCH_K)
+    sketches.replace_one(
+        {"_id": str(user_id)},
+        {
+            "k": sketch.k,
+            "values": Binary(sketch.to_bytes()),
+            "pages": crawl.get("pages", 0),
+            "followers_crawled": crawl.get("count", 0),
+            "built_at": datetime.utcnow(),
+        },
+        upsert=True,
+    )
+    return sketch
+
+
+def _merge_into_sketch(user_id: str, page: int, pks: list):
+    """
+    Fold one saved page into the stored sketch (O(page + k)). Re-merging a page is
+    harmless: KMV sketches ignore duplicates. If earlier pages are missing from the
+    sketch (it predates them), it is rebuilt in the background instead.
+    """
+    sketches = get_collection("audience_sketches")
+    if sketches is None:
+        return
+    doc = sketches.find_one({"_id": str(user_id)}, {"k": 1, "values": 1, "pages": 1})
+    have = doc.get("pages", 0) if doc else 0
+    if have < page:
+        start_sketch_rebuild(user_id)
+        return
+    current = KMVSketch.from_bytes(doc["values"], k=doc.get("k", SKETCH_K)) if doc else KMVSketch(SKETCH_K)
+    merged = KMVSketch.union([current, KMVSketch.from_ids(pks, k=current.k)])
+    sketches.update_one(
+        {"_id": str(user_id)},
+        {
+            "$set": {"k": merged.k, "values": Binary(merged.to_bytes()), "pages": max(have, page + 1), "built_at": datetime.utcnow()},
+            "$inc": {"followers_crawled": len(pks)},
+        },
+        upsert=True,
+    )
+
+
+_rebuilding: set[str] = set()
+_rebuilding_lock = threading.Lock()
+
+
+def start_sketch_rebuild(user_id: str) -> bool:
+    """Rebuild a stale sketch in a daemon thread. False if one is already running here."""
+    with _rebuilding_lock:
+        if str(user_id) in _rebuilding:
+            return False
+        _rebuilding.add(str(user_id))
+
+    def run():
+        try:
+            build_audience_sketch(user_id)
+        except Exception as e:
+            print(f"audience sketch build error for {user_id}: {e}")
+        finally:
+            with _rebuilding_lock:
+                _rebuilding.discard(str(user_id))
+
+    threading.Thread(target=run, name=f"sketch-{user_id}", daemon=True).start()
+    return True
+
+
+def load_audience_sketch(user_id: str) -> tuple[KMVSketch | None, dict]:
+    """
+    Stored sketch for `user_id` (one small read; never rebuilt in the request).
+    A sketch behind the crawl is used as-is while it is rebuilt in the background;
+    None if there is no sketch yet.
+    """
+    sketches = get_collection("audience_sketches")
+    if sketches is None:
+        return None, {}
+    crawl = get_crawl(user_id) or {}
+    doc = sketches.find_one({"_id": str(user_id)})
+    if crawl.get("pages") and (doc is None or doc.get("pages", 0) < crawl["pages"]):
+        start_sketch_rebuild(user_id)
+    if doc is None:
+        return None, crawl
+    crawl["sketch_pages"] = doc.get("pages", 0)
+    return KMVSketch.from_bytes(doc["values"], k=doc.get("k", SKETCH_K)), crawl
+
+
+# ----------------- Upstream -----------------
+class _BudgetWaitExceeded(Exception):
+    pass
+
+
+def _wait_for_budget(max_wait: float | None = None) -> bool:
+    """
+    Block until one crawl call fits: under FOLLOWER_CRAWL_CALLS_PER_MINUTE and with
+    this worker's RapidAPI budget above the interactive reserve. False once
+    `max_wait` seconds have passed (None waits as long as it takes).
+    """
+    reserve = int(RAPIDAPI_BUDGET.limit * FOLLOWER_CRAWL_RESERVE)
+    give_up = None if max_wait is None else time.monotonic() + max_wait
+    while True:
+        delay = 1.0
+        if RAPIDAPI_BUDGET.remaining() > reserve:
+            retry_after = quota_hit("followers:crawl", FOLLOWER_CRAWL_CALLS_PER_MINUTE, 60)
+            if retry_after is None:
+                return True
+            delay = min(max(delay, retry_after), 5.0)
+        if give_up is not None:
+            left = give_up - time.monotonic()
+            if left <= 0:
+                return False
+            delay = min(delay, left)
+        time.sleep(delay)
+
+
+def _fetch_page(user_id: str, next_max_id: str | None, budget_wait: float | None = None) -> dict:
+    """
+    One /followers page with retry/backoff. Raises HTTPException(502) when exhausted,
+    _BudgetWaitExceeded when no budget frees up within `budget_wait` seconds.
+    """
+    params = {"user_id": str(user_id)}
+    if next_max_id:
+        params["next_max_id"] = next_max_id
+    last_error = None
+    for attempt in range(FOLLOWER_MAX_RETRIES):
+        if not _wait_for_budget(budget_wait):
+            raise _BudgetWaitExceeded()
+        try:
+            resp = rapid_get(FOLLOWERS_URL, params, timeout=20.0)
+        except Exception as e:
+            last_error = f"RapidAPI request error (followers): {e}"
+        else:
+            if resp.status_code == 200:
+                try:
+                    return resp.json()
+                except Exception as e:
+                    last_error = f"Invalid JSON from RapidAPI (followers): {e}"
+            else:
+                last_error = f"RapidAPI error (followers): {resp.status_code} {resp.text[:200]}"
+                if resp.status_code == 429:
+                    time.sleep(10 * (attempt + 1))
+        time.sleep(2 ** attempt)
+    raise HTTPException(status_code=502, detail=last_error)
+
+
+def crawl_followers(
+    user_id: str,
+    next_max_id: str | None = None,
+    max_pages: int | None = None,
+    resume: bool = True,
+    budget_wait: float | None = None,
+) -> Iterator[dict]:
+    """
+    Page through `user_id`'s followers, persisting each page before yielding it.
+    Starts from the stored cursor (resume), else from `next_max_id`, else from the
+    beginning. When resuming, `next_max_id` must match the stored cursor; with
+    resume=false it restarts the crawl from that cursor. Stops (paused) when
+    waiting for crawl budget takes longer than `budget_wait` seconds.
+    Raises HTTPException(409) if another crawl holds the lease or the cursor doesn't match.
+    """
+    if not RAPIDAPI_KEY:
+        raise HTTPException(status_code=500, detail="No RAPIDAPI_KEY configured")
+    owner = uuid.uuid4().hex
+    state = _acquire_lease(user_id, owner)
+    if state is None:
+        raise HTTPException(status_code=409, detail="A follower crawl for this user is already running")
+
+    if not resume:
+        _reset(user_id)
+    page = state.get("pages", 0) if resume else 0
+    stored_cursor = state.get("next_max_id") if resume and page else None
+    if resume and page and next_max_id and next_max_id != stored_cursor:
+        # storing it at index `page` would duplicate or reorder pages
+        _finish(user_id, owner, "paused" if stored_cursor else "done")
+        raise HTTPException(
+            status_code=409,
+            detail="next_max_id does not match the stored crawl cursor; omit it to resume, or pass resume=false to restart from it",
+        )
+    cursor = stored_cursor or next_max_id
+    if resume and page and not cursor:
+        # previous crawl reached the last page
+        _finish(user_id, owner, "done")
+        return
+
+    status, error, fetched = "paused", None, 0
+    try:
+        while max_pages is None or fetched < max_pages:
+            try:
+                data = _fetch_page(user_id, cursor, budget_wait)
+            except _BudgetWaitExceeded:
+                break
+            users = data.get("users") or []
+            new_cursor = data.get("next_max_id") or None
+            pks = [u.get("pk") or u.get("id") for u in users if isinstance(u, dict)]
+            if not _save_page(user_id, owner, page, cursor, new_cursor, [pk for pk in pks if pk]):
+                error = "lease lost to another crawler"
+                break
+            yield {
+                "page": page,
+                "cursor": cursor,
+                "next_max_id": new_cursor,
+                "count": len(users),
+                "users": [
+                    {"pk": u.get("pk") or u.get("id"), "username": u.get("username"), "full_name": u.get("full_name")}
+                    for u in users if isinstance(u, dict)
+                ],
+            }
+            page, cursor, fetched = page + 1, new_cursor, fetched + 1
+            if not cursor:
+                status = "done"
+                break
+            time.sleep(FOLLOWER_PAGE_DELAY)
+    except HTTPException as e:
+        status, error = "failed", str(e.detail)
+        raise
+    finally:
+        # GeneratorExit (client went away) leaves the crawl paused at the stored cursor
+        _finish(user_id, owner, status, error)
+
+
+# ----------------- Background crawls -----------------
+_background: dict[str, threading.Thread] = {}
+_background_lock = threading.Lock()
+
+
+def _run_background(user_id: str):
+    try:
+        for _ in crawl_followers(user_id):
+            pass
+    except HTTPException as e:
+        print(f"follower crawl for {user_id} stopped: {e.detail}")
+    except Exception as e:
+        print(f"follower crawl for {user_id} error: {e}")
+    finally:
+        with _background_lock:
+            _background.pop(str(user_id), None)
+
+
+def _running_crawls() -> int:
+    crawls = get_collection("follower_crawls")
+    if crawls is None:
+        return len(_background)
+    return crawls.count_documents({"status": "running", "lease_until": {"$gt": datetime.utcnow()}})
+
+
+def start_background_crawl(user_id: str) -> bool:
+    """
+    Start (or resume) a crawl in a daemon thread. False if one is already running here;
+    HTTPException(429) when FOLLOWER_MAX_CRAWLS crawls are already running.
+    """
+    with _background_lock:
+        if str(user_id) in _background:
+            return False
+        if len(_background) >= FOLLOWER_MAX_CRAWLS or _running_crawls() >= FOLLOWER_MAX_CRAWLS:
+            raise HTTPException(
+                status_code=429,
+                detail=f"{FOLLOWER_MAX_CRAWLS} follower crawls are already running, please retry later",
+                headers={"Retry-After": str(LEASE_SECONDS)},
+            )
+        thread = threading.Thread(target=_run_background, args=(str(user_id),), name=f"followers-{user_id}", daemon=True)
+        _background[str(user_id)] = thread
+        thread.start()
+        return True
+
+
+# ----------------- Routes -----------------
+@router.get("/fetch_rapid_followers", dependencies=[Depends(quota("lookup"))])
+def get_rapid_followers(
+    user_id: str,
+    next_max_id: str | None = None,
+    max_pages: int = Query(FOLLOWER_STREAM_PAGES, ge=1, le=FOLLOWER_STREAM_MAX_PAGES),
+    resume: bool = True,
+    current_user: dict = Depends(get_current_user),
+):
+    """
+    GET /influencers/fetch_rapid_followers?user_id=12345[&next_max_id=...][&max_pages=5]
+    Streams up to `max_pages` follower pages as NDJSON (one JSON object per line) while
+    storing ids; call again to continue. The crawl resumes from the last stored cursor
+    (resume=false restarts, from next_max_id if given). Full crawls: POST /followers/crawl.
+    A final {"done": ..., "next_max_id": ...} line tells the client where to continue;
+    the stream also ends there early when crawl budget stays exhausted for
+    FOLLOWER_STREAM_BUDGET_WAIT seconds.
+    """
+    pages = crawl_followers(
+        user_id, next_max_id=next_max_id, max_pages=max_pages, resume=resume, budget_wait=FOLLOWER_STREAM_BUDGET_WAIT
+    )
+    # surface lease/config errors as HTTP errors before streaming starts
+    try:
+        first = next(pages)
+    except StopIteration:
+        first = None
+
+    def stream():
+        last = first
+        try:
+            if first is not None:
+                yield dumps(first) + b"\n"
+                for page in pages:
+                    last = page
+                    yield dumps(page) + b"\n"
+        except HTTPException as e:
+            yield dumps({"error": e.detail}) + b"\n"
+        state = get_crawl(user_id)
+        if state is not None:
+            next_cursor, done = state.get("next_max_id"), state.get("status") == "done"
+        else:
+            next_cursor = last["next_max_id"] if last else next_max_id
+            done = last is not None and next_cursor is None
+        yield dumps({"done": done, "next_max_id": next_cursor}) + b"\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@router.post("/followers/crawl", dependencies=[Depends(quota("crawl"))])
+def start_followers_crawl(user_id: str, current_user: dict = Depends(get_current_user)):
+    """Start or resume a background crawl; poll GET /followers/crawl for progress."""
+    if get_collection("follower_crawls") is None:
+        raise HTTPException(status_code=503, detail="Database not configured")
+    started = start_background_crawl(user_id)
+    return {"user_id": str(user_id), "started": started, "crawl": get_crawl(user_id)}
+
+
+@router.get("/followers/crawl")
+def followers_crawl_status(user_id: str, current_user: dict = Depends(get_current_user)):
+    crawl = get_crawl(user_id)
+    if crawl is None:
+        raise HTTPException(status_code=404, detail="No crawl for this user")
+    return crawl
+
+
+class OverlapRequest(BaseModel):
+    user_ids: list[str] = Field(..., min_length=2, max_length=20)
+
+
+@router.post("/audience/overlap")
+def audience_overlap(body: OverlapRequest, current_user: dict = Depends(get_current_user)):
+    """
+    Estimate pairwise and multi-way audience overlap plus unique combined reach
+    for a shortlist, from each account's stored follower sketch.
+    Accounts must have been crawled (POST /followers/crawl); partial crawls are
+    used as-is and flagged with complete=false.
+    """
+    if get_collection("audience_sketches") is None:
+        raise HTTPException(status_code=503, detail="Database not configured")
+    user_ids = list(dict.fromkeys(str(u) for u in body.user_ids))
+    if len(user_ids) < 2:
+        raise HTTPException(status_code=400, detail="At least two distinct user_ids are required")
+
+    sketches, crawls, missing, building = {}, {}, [], []
+    for uid in user_ids:
+        sketch, crawl = load_audience_sketch(uid)
+        if sketch is None:
+            (building if crawl.get("pages") else missing).append(uid)
+            continue
+        sketches[uid], crawls[uid] = sketch, crawl
+    if missing or building:
+        raise HTTPException(
+            status_code=404,
+            detail={"message": "No follower sketch for some accounts", "missing": missing, "building": building},
+        )
+
+    result = estimate_overlap(sketches)
+    for account in result["accounts"]:
+        crawl = crawls[account["user_id"]]
+        account["followers_crawled"] = crawl.get("count", 0)
+        # false while the crawl (or a background sketch rebuild) is still catching up
+        account["complete"] = crawl.get("status") == "done" and crawl.get("sketch_pages", 0) >= crawl.get("pages", 0)
+    return result
@@ -4,18 +4,27 @@ from typing import List, Dict, Any
 from datetime import datetime
 import requests
 import os
-from dotenv import load_dotenv
 from math import log10
 import re
 import json
-from db import searches_collection
+from db import get_collection
+from pymongo import UpdateOne
 from datetime import datetime
 import time
 import random
 from functools import lru_cache
 from fastapi import Depends
 from auth import get_current_user
-load_dotenv()
+from responses import parse_fields, project, mongo_projection
+from ratelimit import RAPIDAPI_BUDGET
+from concurrent.futures import ThreadPoolExecutor
+from quotas import quota, check_quota, rapidapi_scheduler, openai_scheduler
+from coalesce import SingleFlight, MongoLease
+from deadline import DeadlineExceeded, deadline_scope, deadline_expired, clamp_timeout, pace
+from tracing import span
+from negative_cache import negative_cache, classify_status, classify_exception, describe
+import threading
+import contextvars
 
 router = APIRouter()
 
@@ -25,79 +34,117 @@ RAPIDAPI_KEY = os.getenv("RAPIDAPI_KEY")
 
 OPENAI_KEY = os.getenv("OPENAI_KEY")
 
+# concurrent cold searches with the same cache key share one upstream run;
+# SEARCH_COALESCE_SHARED=1 extends that across workers via a Mongo lease
+SEARCH_COALESCE_SHARED = os.getenv("SEARCH_COALESCE_SHARED", "0") == "1"
+SEARCH_COALESCE_WAIT = float(os.getenv("SEARCH_COALESCE_WAIT", 180))
+search_flight = SingleFlight()
+search_lease = MongoLease("search_leases", ttl_seconds=int(SEARCH_COALESCE_WAIT))
 
+# default overall time bound for a cold /search/top (seconds; 0 disables)
+SEARCH_DEADLINE_SECONDS = float(os.getenv("SEARCH_DEADLINE_SECONDS", 25))
 
+MULTI_SEARCH_MAX_KEYWORDS = int(os.getenv("MULTI_SEARCH_MAX_KEYWORDS", 10))
+MULTI_SEARCH_CONCURRENCY = int(os.getenv("MULTI_SEARCH_CONCURRENCY", 4))
+
+
+def rapid_get(url: str, params: dict, timeout: float):
+    """
+    GET against RapidAPI; every call is counted against the shared rate budget.
+    The timeout is clamped to the request deadline (DeadlineExceeded once it is spent).
+    """
+    headers = {
+        "x-rapidapi-host": RAPIDAPI_HOST,
+        "x-rapidapi-key": RAPIDAPI_KEY,
+    }
+    timeout = clamp_timeout(timeout)
+    RAPIDAPI_BUDGET.record()
+    with span(f"rapidapi.{url.rsplit('/', 1)[-1]}", params=params) as s:
+        resp = requests.get(url, headers=headers, params=params, timeout=timeout)
+        if s is not None:
+            s.attrs["status"] = resp.status_code
+        return resp
 
 
 
 
 
 
-@router.get("/search/top")
-def search_top_influencers(keyword: str, limit: int = 10, user_id: str | None = None, current_user: dict = Depends(get_current_user)):
-    """
-    Search top influencers by keyword using Mongo cache + RapidAPI.
-    - Cache key: normalized keyword + limit
-    - First tries exact normalized lookup (keyword lowercased + int limit).
-    - If not found, tries case-insensitive lookup with same limit.
-    - Stores normalized keyword + raw keyword + limit when saving.
-    """
-    if not keyword:
-        raise HTTPException(status_code=400, detail="keyword is required")
 
+
+
+def _cache_key(keyword: str, limit: int, user_id: str | None = None):
+    """Normalize keyword/limit/user_id into (raw_keyword, key, cache_query)."""
     raw_keyword = keyword.strip()
     key = raw_keyword.lower()
     # include user_id in cache key when provided so cached results are user-scoped
     cache_query = {"keyword": key, "limit": int(limit)}
     if user_id:
         cache_query["user_id"] = str(user_id)
+    return raw_keyword, key, cache_query
 
-    # Try exact cached entry first -> return immediate if found
-    if searches_collection is not None:
-        try:
-            cached = searches_collection.find_one(cache_query)
-            if cached and "results" in cached:
-                return {"results": cached["results"], "cached": True}
-            # fallback: case-insensitive keyword match (same limit) — include user_id if present
-            regex_q = {"keyword": {"$regex": f"^{re.escape(raw_keyword)}$", "$options": "i"}, "limit": int(limit)}
-            if user_id:
-                regex_q["user_id"] = str(user_id)
-            cached = searches_collection.find_one(regex_q)
-            if cached and "results" in cached:
-                return {"results": cached["results"], "cached": True}
-        except Exception as e:
-            print("search cache lookup error:", e)
 
-    # Fetch from RapidAPI when not cached
+def _resolve_pks(pks: List[Any], field_list: List[str] | None = None) -> List[dict]:
+    """
+    Resolve an ordered pk list against the influencers collection with a single
+    batched $in lookup. Order is preserved; pks without a profile are skipped.
+    """
+    influencers_collection = get_collection("influencers")
+    if influencers_collection is None or not pks:
+        return []
+    ids = [str(pk) for pk in pks]
+    # full documents unless fields= was given; _id is always needed to restore order
+    projection = {**mongo_projection(field_list, always=("pk",)), "_id": 1} if field_list else None
+    by_id = {}
+    for doc in influencers_collection.find({"_id": {"$in": ids}}, projection):
+        by_id[doc.pop("_id")] = doc
+    return [by_id[i] for i in ids if i in by_id]
+
+
+def _load_cached_search(query: dict, field_list: List[str] | None = None, record_hit: bool = True) -> List[dict] | None:
+    """
+    Return resolved results for a cached search doc matching `query`, or None.
+    Hits bump `hits`/`last_hit_at` in the same round trip (used by cache warming).
+    """
+    searches_collection = get_collection("searches")
+    if searches_collection is None:
+        return None
+    projection = {"_id": 0, "pks": 1, **mongo_projection(field_list, prefix="results.", always=("pk",))}
+    with span("mongo.search_cache_lookup", hit=False) as s:
+        if record_hit:
+            cached = searches_collection.find_one_and_update(
+                query,
+                {"$inc": {"hits": 1}, "$set": {"last_hit_at": datetime.utcnow()}},
+                projection=projection,
+            )
+        else:
+            cached = searches_collection.find_one(query, projection)
+        if s is not None:
+            s.attrs["hit"] = cached is not None
+    if not cached:
+        return None
+    if "pks" in cached:
+        with span("mongo.resolve_pks", count=len(cached["pks"])):
+            return _resolve_pks(cached["pks"], field_list)
+    # legacy documents with embedded copies (expire via TTL)
+    if "results" in cached:
+        return cached["results"]
+    return None
+
+
+def _users_search(raw_keyword: str, limit: int) -> List[dict]:
+    """Call RapidAPI /users_search. Raises HTTPException(502) on upstream failure."""
     url = "https://instagram-best-experience.p.rapidapi.com/users_search"
-    headers = {
-        "x-rapidapi-host": RAPIDAPI_HOST,
-        "x-rapidapi-key": RAPIDAPI_KEY,
-    }
     params = {"query": raw_keyword, "count": limit}
 
     try:
-        resp = requests.get(url, headers=headers, params=params, timeout=15.0)
+        resp = rapid_get(url, params, timeout=15.0)
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=f"RapidAPI search did not finish in time: {e}")
     except Exception as e:
-        # If API fails, try to return any cached entry (ignore limit) before failing
-        if searches_collection is not None:
-            try:
-                fallback = searches_collection.find_one({"keyword": {"$regex": f"^{re.escape(raw_keyword)}$", "$options": "i"}})
-                if fallback and "results" in fallback:
-                    return {"results": fallback["results"], "cached": True, "stale": True}
-            except Exception:
-                pass
         raise HTTPException(status_code=502, detail=f"RapidAPI request error: {e}")
 
     if resp.status_code != 200:
-        # try fallback cache before raising
-        if searches_collection is not None:
-            try:
-                fallback = searches_collection.find_one({"keyword": {"$regex": f"^{re.escape(raw_keyword)}$", "$options": "i"}})
-                if fallback and "results" in fallback:
-                    return {"results": fallback["results"], "cached": True, "stale": True}
-            except Exception:
-                pass
         raise HTTPException(status_code=502, detail=f"RapidAPI error: {resp.text}")
 
     try:
@@ -111,24 +158,25 @@ def search_top_influencers(keyword: str, limit: int = 10, user_id: str | None =
         users_list = data
     else:
         users_list = []
+    return [u for u in users_list[:limit] if isinstance(u, dict)]
 
-    results = []
-    for user in users_list[:limit]:
-        if not isinstance(user, dict):
-            continue
 
-        pk = user.get("pk") or user.get("id")
-        username = user.get("username")
-        profile = {
-            "pk": pk,
-            "username": username,
-            "full_name": user.get("full_name") or user.get("name"),
-            "followers": user.get("follower_count"),
-            "profile_pic": user.get("profile_pic_url"),
-            "bio": user.get("biography") or user.get("bio", ""),
-        }
+def _base_profile(user: dict) -> dict:
+    """Map a /users_search hit to the result row shape."""
+    return {
+        "pk": user.get("pk") or user.get("id"),
+        "username": user.get("username"),
+        "full_name": user.get("full_name") or user.get("name"),
+        "followers": user.get("follower_count"),
+        "profile_pic": user.get("profile_pic_url"),
+        "bio": user.get("biography") or user.get("bio", ""),
+    }
+
 
-        # Enrich per-user: try to fetch profile + insights (best-effort)
+def _enrich_profile(profile: dict) -> dict:
+    """Enrich a result row in place with profile + feed insights (best-effort)."""
+    pk = profile.get("pk")
+    with span("enrich", pk=pk):
         try:
             prof = None
             try:
@@ -162,47 +210,370 @@ def search_top_influencers(keyword: str, limit: int = 10, user_id: str | None =
                         "engagement_rate_percent": None,
                     })
         except Exception as e:
-            print(f"enrichment error for {username or pk}: {e}")
+            print(f"enrichment error for {profile.get('username') or pk}: {e}")
+    return profile
+
+
+def _save_influencers(results: List[dict]):
+    """Upsert enriched profiles into the per-influencer collection (best-effort)."""
+    influencers_collection = get_collection("influencers")
+    if influencers_collection is None:
+        return
+    now = datetime.utcnow()
+    ops = [
+        UpdateOne({"_id": str(r["pk"])}, {"$set": {**r, "updated_at": now}}, upsert=True)
+        for r in results
+        if r.get("pk")
+    ]
+    if not ops:
+        return
+    try:
+        influencers_collection.bulk_write(ops, ordered=False)
+    except Exception as e:
+        print("influencer cache write error:", e)
 
-        results.append(profile)
-        time.sleep(0.25)
 
-    # Save to Mongo (best-effort) — store normalized keyword + raw + limit
-    if searches_collection is not None:
+def _save_search(cache_query: dict, raw_keyword: str, results: List[dict], record_hit: bool = True, save_profiles: bool = True):
+    """
+    Store the ordered pk list + search metadata for `cache_query` (best-effort).
+    Hit counters survive refreshes so search history keeps accumulating.
+    """
+    searches_collection = get_collection("searches")
+    if searches_collection is None:
+        return
+    with span("mongo.search_cache_write", count=len(results)):
+        if save_profiles:
+            _save_influencers(results)
         try:
+            now = datetime.utcnow()
             doc = {
-                "keyword": key,
+                **cache_query,
                 "keyword_raw": raw_keyword,
-                "limit": int(limit),
-                "results": results,
-                "created_at": datetime.utcnow(),
+                "pks": [str(r["pk"]) for r in results if r.get("pk")],
+                "count": len(results),
+                "created_at": now,
             }
-            # attach user_id to stored doc when provided
-            if user_id:
-                doc["user_id"] = str(user_id)
+            update = {"$set": doc, "$unset": {"results": ""}}
+            if record_hit:
+                doc["last_hit_at"] = now
+                update["$inc"] = {"hits": 1}
             # use normalized cache_query to upsert so subsequent exact lookups succeed
-            searches_collection.replace_one(cache_query, doc, upsert=True)
+            searches_collection.update_one(cache_query, update, upsert=True)
         except Exception as e:
             print("search cache write error:", e)
 
-    return {"results": results, "cached": False}
+
+def refresh_search(keyword: str, limit: int = 10, user_id: str | None = None, record_hit: bool = True, hold=None) -> List[dict]:
+    """
+    Run /users_search + enrichment for a keyword and write it to the cache.
+    Under a request deadline (deadline.py), rows not enriched in time are returned
+    as base hits with status="pending" (finished rows: status="complete") and
+    enrichment continues in a background thread, which writes the cache when done.
+    `hold(snapshot)` (see coalesced_refresh_search) is called before handing off:
+    it publishes the snapshot and keeps the coalescing key and the caller's
+    RapidAPI slot until the background work is done.
+    """
+    raw_keyword, key, cache_query = _cache_key(keyword, limit, user_id)
+    results, pending = [], []
+    for user in _users_search(raw_keyword, limit):
+        row = _base_profile(user)
+        if not deadline_expired():
+            _enrich_profile(row)
+        # a row whose enrichment ran into the deadline may be incomplete
+        if deadline_expired():
+            pending.append(row)
+        results.append(row)
+        pace(0.25)
+
+    if not pending:
+        _save_search(cache_query, raw_keyword, results, record_hit=record_hit)
+        return [{**r, "status": "complete"} for r in results]
+
+    # snapshot for the response; the background thread keeps mutating `results`
+    pending_ids = {id(r) for r in pending}
+    snapshot = [{**r, "status": "pending" if id(r) in pending_ids else "complete"} for r in results]
+    release = hold(snapshot) if hold else None
+
+    def finish():
+        try:
+            for row in pending:
+                _enrich_profile(row)
+                time.sleep(0.25)
+            _save_search(cache_query, raw_keyword, results, record_hit=record_hit)
+        except Exception as e:
+            print(f"background enrichment error for {raw_keyword!r}: {e}")
+        finally:
+            if release:
+                release()
+
+    # plain Thread: the request deadline (a context variable) is not inherited
+    threading.Thread(target=finish, name=f"enrich-{key}", daemon=True).start()
+    return snapshot
+
+
+def coalesced_refresh_search(keyword: str, limit: int, user_id: str | None, quota_key: str) -> tuple[List[dict], bool]:
+    """
+    refresh_search, coalesced by normalized cache key. Returns (results, coalesced):
+    only the leader takes a RapidAPI slot; followers wait for its result.
+    While a partial result is still being finished in the background, the key (and
+    the leader's slot) stays held, so identical requests, in this worker or another
+    (SEARCH_COALESCE_SHARED, via the lease), get that snapshot instead of starting
+    another refresh.
+    Waiting (for the leader, a lease or a slot) is bounded by the request deadline: 504.
+    """
+    raw_keyword, key, cache_query = _cache_key(keyword, limit, user_id)
+    flight_key = f"{key}|{int(limit)}|{user_id or ''}"
+
+    def run(hold=None):
+        release_slot = rapidapi_scheduler.acquire(quota_key)
+        handed_off = []
+
+        def hold_slot(snapshot=None):
+            # background enrichment keeps this user's slot, so it stays within the fair share
+            handed_off.append(True)
+            return release_slot
+
+        try:
+            return refresh_search(keyword, limit, user_id, hold=_hold_all(hold_slot, hold))
+        finally:
+            if not handed_off:
+                release_slot()
+
+    def lead(flight_hold):
+        if not SEARCH_COALESCE_SHARED:
+            return run(flight_hold), True
+
+        def run_leased(lease_hold):
+            return run(_hold_all(flight_hold, lease_hold))
+
+        return search_lease.run(
+            flight_key,
+            run_leased,
+            poll=lambda: _load_cached_search(cache_query, record_hit=False),
+            timeout=SEARCH_COALESCE_WAIT,
+        )
+
+    try:
+        (results, ran), leader = search_flight.do(flight_key, lead)
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=f"Search did not finish in time: {e}")
+    return results, not (leader and ran)
+
+
+def _hold_all(*holds):
+    """Combine `hold` callables: holding all of them, releasing all of them."""
+    holds = [h for h in holds if h]
+
+    def hold(interim=None):
+        releases = [h(interim) for h in holds]
+
+        def release():
+            for r in releases:
+                r()
+
+        return release
+
+    return hold
+
+
+def refresh_influencer(pk: str) -> dict | None:
+    """Re-enrich one cached influencer profile in place (used by cache warming)."""
+    influencers_collection = get_collection("influencers")
+    if influencers_collection is None:
+        return None
+    doc = influencers_collection.find_one({"_id": str(pk)}, {"_id": 0, "updated_at": 0})
+    if not doc:
+        return None
+    _save_influencers([_enrich_profile(doc)])
+    return doc
+
+
+@router.get("/search/top")
+def search_top_influencers(keyword: str, limit: int = 10, user_id: str | None = None, fields: str | None = None, deadline: float | None = None, current_user: dict = Depends(get_current_user), quota_key: str = Depends(quota("search"))):
+    """
+    Search top influencers by keyword using Mongo cache + RapidAPI.
+    - Cache key: normalized keyword + limit
+    - First tries exact normalized lookup (keyword lowercased + int limit).
+    - If not found, tries case-insensitive lookup with same limit.
+    - Stores normalized keyword + raw keyword + limit + ordered pk list when saving;
+      profiles live once in the influencers collection and are resolved with $in.
+    - `fields=username,followers,...` limits each row to those keys (pk is always kept);
+      cache hits only read the requested keys from Mongo.
+    - Per-user quota (429 + Retry-After); cache misses wait for a fair-share RapidAPI slot.
+    - Identical concurrent cache misses are coalesced into one upstream run (coalesced=true).
+    - `deadline=<seconds>` (default SEARCH_DEADLINE_SECONDS) bounds a cold search: every upstream
+      call/retry/sleep is clamped to it. Rows not enriched in time come back with status="pending"
+      (partial=true) and finish in the background into the cache.
+    """
+    if not keyword:
+        raise HTTPException(status_code=400, detail="keyword is required")
+
+    field_list = parse_fields(fields)
+    raw_keyword, key, cache_query = _cache_key(keyword, limit, user_id)
+    searches_collection = get_collection("searches")
+
+    # Try exact cached entry first -> return immediate if found
+    if searches_collection is not None:
+        try:
+            cached = _load_cached_search(cache_query, field_list)
+            if cached is not None:
+                return {"results": cached, "cached": True}
+            # fallback: case-insensitive keyword match (same limit) — include user_id if present
+            regex_q = {"keyword": {"$regex": f"^{re.escape(raw_keyword)}$", "$options": "i"}, "limit": int(limit)}
+            if user_id:
+                regex_q["user_id"] = str(user_id)
+            cached = _load_cached_search(regex_q, field_list)
+            if cached is not None:
+                return {"results": cached, "cached": True}
+        except Exception as e:
+            print("search cache lookup error:", e)
+
+    # Fetch from RapidAPI when not cached
+    try:
+        with deadline_scope(SEARCH_DEADLINE_SECONDS if deadline is None else deadline):
+            results, coalesced = coalesced_refresh_search(keyword, limit, user_id, quota_key)
+    except HTTPException:
+        # If API fails, try to return any cached entry (ignore limit) before failing
+        if searches_collection is not None:
+            try:
+                fallback = _load_cached_search({"keyword": {"$regex": f"^{re.escape(raw_keyword)}$", "$options": "i"}}, field_list)
+                if fallback is not None:
+                    return {"results": fallback, "cached": True, "stale": True}
+            except Exception:
+                pass
+        raise
+
+    if field_list:
+        results = [project(r, field_list, always=("pk", "status")) for r in results]
+    partial = any(r.get("status") == "pending" for r in results)
+    return {"results": results, "cached": False, "coalesced": coalesced, "partial": partial}
+
+
+
+@router.get("/search/multi")
+def search_multi_keywords(keywords: str, limit: int = 10, user_id: str | None = None, fields: str | None = None, current_user: dict = Depends(get_current_user), quota_key: str = Depends(quota("search"))):
+    """
+    Search a cluster of related keywords at once.
+    GET /influencers/search/multi?keywords=vegan food,plant based,healthy recipes&limit=10
+    - Cached keywords are served from the search cache; the rest run /users_search concurrently.
+    - Hits are merged by pk and each unique creator is enriched exactly once.
+    - Returns a unified ranked list (most keywords matched, then best position, then followers),
+      each row with its `keywords`, plus per-keyword `membership` (ordered pks).
+    - Per-keyword cache entries are written as a side effect, so later /search/top calls hit.
+    """
+    field_list = parse_fields(fields)
+    raw_keywords = list(dict.fromkeys(k.strip() for k in keywords.split(",") if k.strip()))
+    if not raw_keywords:
+        raise HTTPException(status_code=400, detail="keywords is required")
+    if len(raw_keywords) > MULTI_SEARCH_MAX_KEYWORDS:
+        raise HTTPException(status_code=400, detail=f"At most {MULTI_SEARCH_MAX_KEYWORDS} keywords per request")
+
+    profiles: Dict[str, dict] = {}        # str(pk) -> row (enriched or cached)
+    membership: Dict[str, List[str]] = {}  # keyword -> ordered pks
+    hits: Dict[str, List[dict]] = {}       # uncached keyword -> raw /users_search hits
+    errors: Dict[str, str] = {}
+    cached_keywords = []
+
+    for raw in raw_keywords:
+        _, _, cache_query = _cache_key(raw, limit, user_id)
+        cached = None
+        try:
+            cached = _load_cached_search(cache_query)
+        except Exception as e:
+            print("search cache lookup error:", e)
+        if cached is None:
+            hits[raw] = []
+            continue
+        cached_keywords.append(raw)
+        membership[raw] = [str(r["pk"]) for r in cached if r.get("pk")]
+        for r in cached:
+            if r.get("pk"):
+                profiles.setdefault(str(r["pk"]), r)
+
+    if hits:
+        # the dependency charged one search; charge the remaining upstream keywords too
+        for _ in range(len(hits) - 1):
+            check_quota("search", quota_key)
+        with rapidapi_scheduler.slot(quota_key):
+            with ThreadPoolExecutor(max_workers=min(len(hits), MULTI_SEARCH_CONCURRENCY)) as pool:
+                # a context copy per task keeps tracing spans (and any deadline) in the pool threads
+                futures = {raw: pool.submit(contextvars.copy_context().run, _users_search, raw, limit) for raw in hits}
+                for raw, future in futures.items():
+                    try:
+                        hits[raw] = future.result()
+                    except HTTPException as e:
+                        errors[raw] = str(e.detail)
+                    except Exception as e:
+                        errors[raw] = str(e)
+
+            # merge by pk and enrich each creator not already known exactly once
+            enriched = []
+            for raw, users in hits.items():
+                if raw in errors:
+                    continue
+                membership[raw] = []
+                for user in users:
+                    row = _base_profile(user)
+                    if not row.get("pk"):
+                        continue
+                    pk = str(row["pk"])
+                    membership[raw].append(pk)
+                    if pk not in profiles:
+                        profiles[pk] = _enrich_profile(row)
+                        enriched.append(profiles[pk])
+                        time.sleep(0.25)
+
+        _save_influencers(enriched)
+        for raw in hits:
+            if raw in errors:
+                continue
+            _, _, cache_query = _cache_key(raw, limit, user_id)
+            _save_search(cache_query, raw, [profiles[pk] for pk in membership[raw]], save_profiles=False)
+
+    if not membership:
+        raise HTTPException(status_code=502, detail={"message": "All keyword searches failed", "errors": errors})
+
+    # unified ranking
+    matched: Dict[str, List[str]] = {}
+    best_pos: Dict[str, int] = {}
+    for raw, pks in membership.items():
+        for pos, pk in enumerate(pks):
+            matched.setdefault(pk, []).append(raw)
+            best_pos[pk] = min(best_pos.get(pk, pos), pos)
+    ranked = sorted(
+        matched,
+        key=lambda pk: (-len(matched[pk]), best_pos[pk], -(profiles[pk].get("followers") or 0)),
+    )
+    results = []
+    for pk in ranked:
+        row = project(profiles[pk], field_list, always=("pk",))
+        results.append({**row, "keywords": matched[pk]})
+
+    return {
+        "results": results,
+        "membership": membership,
+        "cached_keywords": cached_keywords,
+        "errors": errors,
+    }
 
 
 
 @router.get("/insights")
-def user_insights(username: str | None = None, media_id: str | None = None, user_id: str | None = None, current_user: dict = Depends(get_current_user)):
+def user_insights(username: str | None = None, media_id: str | None = None, user_id: str | None = None, fields: str | None = None, current_user: dict = Depends(get_current_user), quota_key: str = Depends(quota("lookup"))):
     """
     Client endpoint. Accepts:
       - ?user_id=... -> fetch aggregated feed metrics for that user (preferred)
       - ?username=... -> will try to resolve user_id from profile (may be slower)
       - media_id is ignored in this aggregated endpoint (feed aggregation)
+      - ?fields=avg_likes,engagement_rate_percent -> return only those metrics
     Examples:
       GET /influencers/insights?user_id=13460080
       GET /influencers/insights?username=_the_foodigram001
     """
     print(f"[DEBUG] /influencers/insights called with user_id={user_id}, username={username}, media_id={media_id}")
     try:
-        metrics = get_insights(username=username, media_id=media_id, user_id=user_id)
+        with rapidapi_scheduler.slot(quota_key):
+            metrics = get_insights(username=username, media_id=media_id, user_id=user_id)
         print(f"[DEBUG] /influencers/insights result for user_id={user_id}, username={username}: {metrics}")
     except HTTPException as e:
         print(f"[DEBUG] /influencers/insights HTTPException for user_id={user_id}, username={username}: {e.detail}")
@@ -210,7 +581,7 @@ def user_insights(username: str | None = None, media_id: str | None = None, user
     except Exception as e:
         print(f"[DEBUG] /influencers/insights error for user_id={user_id}, username={username}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
-    return metrics
+    return project(metrics, parse_fields(fields))
 
 def get_insights(username: str = None, media_id: str | None = None, user_id: str | None = None) -> dict:
     """
@@ -228,20 +599,23 @@ def get_insights(username: str = None, media_id: str | None = None, user_id: str
         print(f"[DEBUG] get_insights missing user_id for username={username}")
         raise HTTPException(status_code=400, detail="user_id (pk) is required to fetch feed insights.")
 
-    headers = {
-        "x-rapidapi-host": RAPIDAPI_HOST,
-        "x-rapidapi-key": RAPIDAPI_KEY,
-    }
+    known_bad = negative_cache.get("feed", user_id)
+    if known_bad is not None:
+        negative_cache.saved("feed", calls=1, seconds=0.5)
+        print(f"[DEBUG] get_insights negative cache hit for user_id={user_id}: {known_bad['error']}")
+        raise HTTPException(status_code=502, detail=f"RapidAPI error (feed): {describe(known_bad)}")
+
     feed_url = f"https://{RAPIDAPI_HOST}/feed"
     params = {"user_id": str(user_id), "count": 20}   # ✅ only last 20 posts
 
     def fetch_and_parse():
         try:
             print(f"[DEBUG] get_insights requesting feed: {feed_url} params={params}")
-            resp = requests.get(feed_url, headers=headers, params=params, timeout=20.0)
-            time.sleep(0.5)  # Add delay after feed request
+            resp = rapid_get(feed_url, params, timeout=20.0)
+            pace(0.5)  # Add delay after feed request
         except Exception as e:
             print(f"[DEBUG] get_insights RapidAPI request error (feed): {e}")
+            negative_cache.record("feed", user_id, classify_exception(e), detail=str(e))
             raise HTTPException(status_code=502, detail=f"RapidAPI request error (feed): {e}")
 
         if resp.status_code != 200:
@@ -250,6 +624,7 @@ def get_insights(username: str = None, media_id: str | None = None, user_id: str
             except Exception:
                 err = resp.text
             print(f"[DEBUG] get_insights RapidAPI error (feed): {err}")
+            negative_cache.record("feed", user_id, classify_status(resp.status_code), resp.status_code, err)
             raise HTTPException(status_code=502, detail=f"RapidAPI error (feed): {err}")
 
         data = resp.json()
@@ -314,38 +689,68 @@ def get_insights(username: str = None, media_id: str | None = None, user_id: str
     result = fetch_and_parse()
 
     # Fallback: If followers or engagement_rate_percent is None, retry once after 2s delay
+    # (skipped when a request deadline leaves no time for it)
     if result.get("followers") is None or result.get("engagement_rate_percent") is None:
+        if negative_cache.get("profile", user_id) is not None:
+            # the profile lookup is known bad, so a retry can't fill in followers
+            negative_cache.saved("insights_retry", calls=1, seconds=2.5)
+            return result
         print(f"[DEBUG] get_insights missing followers or engagement_rate_percent, retrying after 2s...")
-        time.sleep(2)
-        result = fetch_and_parse()
+        with span("insights.retry", user_id=str(user_id)):
+            pace(2)
+            if not deadline_expired():
+                result = fetch_and_parse()
 
     return result
 
 
-@router.get("/profile")
-def fetch_rapid_follower_profile(user_id: str, current_user: dict = Depends(get_current_user)) -> dict:
+@router.get("/profile", dependencies=[Depends(quota("lookup"))])
+def fetch_rapid_follower_profile(user_id: str, fields: str | None = None, current_user: dict = Depends(get_current_user)) -> dict:
     """
     Fetch profile info from RapidAPI /profile endpoint.
     Returns {follower_count, media_count, username, full_name, ...}
+    `fields=follower_count,media_count` trims the returned keys.
     """
     print(f"[DEBUG] fetch_rapid_follower_profile called with user_id={user_id}")
     if not RAPIDAPI_KEY:
         print(f"[DEBUG] fetch_rapid_follower_profile missing RAPIDAPI_KEY")
         raise HTTPException(status_code=500, detail="No RAPIDAPI_KEY configured")
 
-    url = "https://instagram-best-experience.p.rapidapi.com/profile"
-    headers = {
-        "x-rapidapi-key": RAPIDAPI_KEY,
-        "x-rapidapi-host": RAPIDAPI_HOST,
+    known_bad = negative_cache.get("profile", user_id)
+    if known_bad is None:
+        data = _rapid_profile(user_id)
+    else:
+        # known-bad pk: skip the call and its 2 s pacing sleep
+        negative_cache.saved("profile", calls=1, seconds=2.0)
+        print(f"[DEBUG] fetch_rapid_follower_profile negative cache hit for user_id={user_id}: {known_bad['error']}")
+        if known_bad["error"] != "empty":
+            raise HTTPException(status_code=502, detail=f"RapidAPI error (profile): {describe(known_bad)}")
+        data = {}  # same empty shape a live call returns
+
+    profile = {
+        "user_id": data.get("pk"),
+        "username": data.get("username"),
+        "full_name": data.get("full_name"),
+        "follower_count": data.get("follower_count"),
+        "media_count": data.get("media_count"),
+        "profile_pic_url": data.get("profile_pic_url"),
+        "bio": data.get("biography"),
     }
+    return project(profile, parse_fields(fields))
+
+
+def _rapid_profile(user_id: str) -> dict:
+    """Raw RapidAPI /profile payload; failures and empty accounts go to the negative cache."""
+    url = "https://instagram-best-experience.p.rapidapi.com/profile"
     params = {"user_id": str(user_id)}
 
     try:
         print(f"[DEBUG] fetch_rapid_follower_profile requesting: {url} params={params}")
-        resp = requests.get(url, headers=headers, params=params, timeout=20.0)
-        time.sleep(2)  # <-- Add a 2 second delay after the API call
+        resp = rapid_get(url, params, timeout=20.0)
+        pace(2)  # <-- Add a 2 second delay after the API call
     except Exception as e:
         print(f"[DEBUG] fetch_rapid_follower_profile RapidAPI request error: {e}")
+        negative_cache.record("profile", user_id, classify_exception(e), detail=str(e))
         raise HTTPException(status_code=502, detail=f"RapidAPI request error (profile): {e}")
 
     if resp.status_code != 200:
@@ -354,6 +759,7 @@ def fetch_rapid_follower_profile(user_id: str, current_user: dict = Depends(get_
         except Exception:
             err = resp.text
         print(f"[DEBUG] fetch_rapid_follower_profile RapidAPI error: {err}")
+        negative_cache.record("profile", user_id, classify_status(resp.status_code), resp.status_code, err)
         raise HTTPException(status_code=502, detail=f"RapidAPI error (profile): {err}")
 
     try:
@@ -361,35 +767,27 @@ def fetch_rapid_follower_profile(user_id: str, current_user: dict = Depends(get_
         print(f"[DEBUG] fetch_rapid_follower_profile data received: {data}")
     except Exception as e:
         print(f"[DEBUG] fetch_rapid_follower_profile Invalid JSON: {e}")
+        negative_cache.record("profile", user_id, "upstream_error", detail=f"invalid JSON: {e}")
         raise HTTPException(status_code=502, detail=f"Invalid JSON from RapidAPI (profile): {e}")
 
-    return {
-        "user_id": data.get("pk"),
-        "username": data.get("username"),
-        "full_name": data.get("full_name"),
-        "follower_count": data.get("follower_count"),
-        "media_count": data.get("media_count"),
-        "profile_pic_url": data.get("profile_pic_url"),
-        "bio": data.get("biography"),
-    }
-    
-    
+    if not isinstance(data, dict):
+        data = {}
+    if not (data.get("pk") or data.get("username")):
+        # deleted / unavailable account: 200 with nothing in it
+        negative_cache.record("profile", user_id, "empty", detail="no profile data")
+    return data
 
 
-@router.get("/fetch_rapid_followers")
-def get_rapid_followers(user_id: str, next_max_id: str | None = None):
-    """
-    GET /influencers/fetch_rapid_followers?user_id=12345[&next_max_id=...]
-    Returns RapidAPI followers data for the given user_id.
-    This endpoint is specifically designed for frontend integration.
-    """
-    try:
-        followers_data = fetch_rapid_follower_profile(user_id=user_id)
-        return followers_data
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+@router.get("/cache/negative")
+def negative_cache_status(current_user: dict = Depends(get_current_user)):
+    """Remembered upstream failures by error class, TTLs, and RapidAPI calls saved so far."""
+    return negative_cache.status()
+
+
+@router.delete("/cache/negative/{pk}")
+def negative_cache_forget(pk: str, current_user: dict = Depends(get_current_user)):
+    """Forget cached failures for a pk so its next lookup goes upstream."""
+    return {"pk": pk, "removed": negative_cache.forget(pk)}
 
 
 class SummaryRequest(BaseModel):
@@ -409,7 +807,7 @@ class SummaryRequest(BaseModel):
     profile_pic_url: str | None = None
 
 @router.post("/summary")
-def generate_summary(request: SummaryRequest):
+def generate_summary(request: SummaryRequest, quota_key: str = Depends(quota("summary"))):
     """
     Generates an in-depth (2-3 page) human-friendly analysis of an influencer.
     Uses provided metrics (if available) to analyze engagement, reach and recommend
@@ -478,7 +876,10 @@ def generate_summary(request: SummaryRequest):
 
     try:
         headers = {"Authorization": f"Bearer {OPENAI_KEY}", "Content-Type": "application/json"}
-        resp = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=body, timeout=60.0)
+        with openai_scheduler.slot(quota_key), span("openai.chat_completions"):
+            resp = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=body, timeout=60.0)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=502, detail=f"OpenAI request error: {e}")
 
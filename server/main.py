@@ -5,15 +5,33 @@ from pydantic import BaseModel
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
-import pymongo
+from contextlib import asynccontextmanager
+import threading
 import os
-from dotenv import load_dotenv
 from typing import List, Dict, Any
+import db  # loads .env once; does not connect at import time
+import tracing
+from responses import FastJSONResponse, CompressionMiddleware
 
 
-load_dotenv()
+# set to 0 on workers when indexes are managed once per deploy (`python db.py`)
+MONGO_MANAGE_INDEXES = os.getenv("MONGO_MANAGE_INDEXES", "1") == "1"
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Single startup/shutdown hook. Index creation runs in a background thread so
+    # a slow or unreachable Mongo never blocks worker start; /readyz reports it.
+    # (`warmer` is imported with the routers below.)
+    if MONGO_MANAGE_INDEXES:
+        threading.Thread(target=db.ensure_indexes, name="ensure-indexes", daemon=True).start()
+    warmer.start()
+    yield
+    warmer.stop()
+    db.close()
+
+
+app = FastAPI(default_response_class=FastJSONResponse, lifespan=lifespan)
 
 # --- CORS ---
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://116.202.210.102:3005")
@@ -38,6 +56,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# gzip/brotli for large payloads (search results, exports)
+app.add_middleware(CompressionMiddleware, minimum_size=int(os.getenv("COMPRESSION_MIN_SIZE", 1024)))
 
 
 @app.middleware("http")
@@ -62,18 +82,12 @@ async def ensure_cors_headers(request, call_next):
     return response
 
 
-@app.on_event("startup")
-def startup_db():
-    # Ensure unique index on email to prevent duplicate users
-    try:
-        users_collection.create_index("email", unique=True)
-    except Exception as e:
-        # Index might already exist or connection issue; log in real app
-        print("startup index creation error:", e)
+# span tree for sampled / `X-Trace: 1` requests; untraced requests pass straight through
+app.add_middleware(tracing.TraceMiddleware)
+
 
 # --- MongoDB Connection ---
-# replaced manual connection with shared db module
-from db import db, users_collection, searches_collection
+# shared lazy db module; indexes are created in the lifespan hook
 
 
 # --- JWT Settings ---
@@ -125,7 +139,11 @@ def create_refresh_token(data: dict, expires_delta: timedelta | None = None):
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 def get_user(email: str):
-    return users_collection.find_one({"email": email})
+    users = db.get_collection("users")
+    if users is None:
+        return None
+    with tracing.span("mongo.user_lookup", by="email"):
+        return users.find_one({"email": email})
 
 def authenticate_user(email: str, password: str):
     user = get_user(email)
@@ -157,13 +175,60 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
 
 
 from influencers import router as influencers_router
-from auth import router as auth_router, get_current_user as auth_get_current_user
+from auth import router as auth_router, get_current_user as auth_get_current_user, has_role
+from warming import router as warming_router, warmer
+from followers import router as followers_router
+from export import router as export_router
 
 app.include_router(influencers_router, prefix="/influencers")
+app.include_router(warming_router, prefix="/influencers")
+app.include_router(followers_router, prefix="/influencers")
+app.include_router(export_router, prefix="/influencers")
 # auth_router already defines its own prefix (`/auth`) in `server/auth.py`,
 # so include it without adding another `/auth` prefix to avoid double routes.
 app.include_router(auth_router)
 
+@app.get("/healthz")
+def healthz():
+    # liveness: the process is up and serving; no I/O
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+def readyz():
+    # readiness: Mongo reachable and indexes in place
+    mongo_ok = db.ping()
+    indexes_ok = db.indexes_ready() or not MONGO_MANAGE_INDEXES
+    if mongo_ok and not indexes_ok:
+        # startup attempt may have raced an unreachable Mongo; retry once it's back
+        indexes_ok = db.ensure_indexes()
+    ready = mongo_ok and indexes_ok
+    return FastJSONResponse(
+        {"status": "ready" if ready else "not ready", "mongo": mongo_ok, "indexes": indexes_ok},
+        status_code=200 if ready else 503,
+    )
+
+
+def _trace_owner(user: dict) -> str | None:
+    # None = every user's traces
+    return None if has_role(user, "admin") else str(user["_id"])
+
+
+@app.get("/debug/traces")
+def list_traces(current_user: dict = Depends(auth_get_current_user)):
+    # most recent first; full span trees (and profiles) via /debug/traces/{trace_id}.
+    # traces carry request params, so users only see their own unless admin
+    return {"traces": tracing.recent_traces(_trace_owner(current_user))}
+
+
+@app.get("/debug/traces/{trace_id}")
+def read_trace(trace_id: str, current_user: dict = Depends(auth_get_current_user)):
+    trace = tracing.get_trace(trace_id, _trace_owner(current_user))
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found (expired from the buffer or never sampled)")
+    return trace
+
+
 @app.get("/me")
 def read_users_me(current_user: dict = Depends(auth_get_current_user)):
     return {"username": current_user["username"], "email": current_user["email"]}
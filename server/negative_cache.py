@@ -0,0 +1,178 @@
+# negative_cache.py — remember failed / empty upstream lookups for a short while
+#
+# Private, deleted or throttled accounts fail the same way every time they show
+# up in a search. Failures are remembered per (endpoint, pk) with a TTL that
+# depends on the kind of failure, and callers short-circuit known-bad lookups
+# instead of paying the upstream call (and its pacing sleep) again.
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import requests
+
+from db import get_collection
+from deadline import DeadlineExceeded, deadline_expired
+
+# error class -> seconds to remember it
+NEGATIVE_TTLS = {
+    "not_found": int(os.getenv("NEGATIVE_TTL_NOT_FOUND", 6 * 60 * 60)),
+    "empty": int(os.getenv("NEGATIVE_TTL_EMPTY", 60 * 60)),
+    "forbidden": int(os.getenv("NEGATIVE_TTL_FORBIDDEN", 30 * 60)),
+    "upstream_error": int(os.getenv("NEGATIVE_TTL_UPSTREAM_ERROR", 5 * 60)),
+    "rate_limited": int(os.getenv("NEGATIVE_TTL_RATE_LIMITED", 60)),
+    "timeout": int(os.getenv("NEGATIVE_TTL_TIMEOUT", 30)),
+}
+NEGATIVE_CACHE_BACKEND = os.getenv("NEGATIVE_CACHE_BACKEND", "memory")  # "memory" | "mongo"
+NEGATIVE_CACHE_MAX_ENTRIES = int(os.getenv("NEGATIVE_CACHE_MAX_ENTRIES", 10000))
+
+
+def classify_status(status_code: int) -> str:
+    if status_code == 404:
+        return "not_found"
+    if status_code in (401, 403):
+        return "forbidden"
+    if status_code == 429:
+        return "rate_limited"
+    if status_code in (408, 504):
+        return "timeout"
+    return "upstream_error"
+
+
+def classify_exception(e: Exception) -> str | None:
+    # our own request deadline running out (or clamping the timeout) says nothing about the account
+    if isinstance(e, DeadlineExceeded) or deadline_expired():
+        return None
+    if isinstance(e, (requests.Timeout, requests.ConnectionError)):
+        return "timeout"
+    return "upstream_error"
+
+
+class NegativeCache:
+    """
+    Bounded in-process map of (endpoint, pk) -> failure, optionally shared across
+    workers through a TTL-indexed collection (NEGATIVE_CACHE_BACKEND=mongo).
+    Counters are per process.
+    """
+
+    def __init__(self, collection: str = "negative_cache"):
+        self.collection = collection
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+        self.totals = {
+            "short_circuits": {},
+            "upstream_calls_saved": 0,
+            "sleep_seconds_saved": 0.0,
+            "recorded": {},
+        }
+
+    @staticmethod
+    def _key(endpoint: str, pk) -> str:
+        return f"{endpoint}:{pk}"
+
+    def _shared(self):
+        return get_collection(self.collection) if NEGATIVE_CACHE_BACKEND == "mongo" else None
+
+    def get(self, endpoint: str, pk) -> dict | None:
+        """The remembered failure for this lookup, or None if it should be tried."""
+        key = self._key(endpoint, pk)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["expires_at"] <= now:
+                del self._entries[key]
+                entry = None
+        if entry is not None:
+            return entry
+        shared = self._shared()
+        if shared is None:
+            return None
+        try:
+            doc = shared.find_one({"_id": key, "expires_at": {"$gt": datetime.utcnow()}}, {"_id": 0, "pk": 0})
+        except Exception as e:
+            print("negative cache read error:", e)
+            return None
+        if doc is None:
+            return None
+        # stored as naive UTC for the TTL index; kept in memory as epoch seconds
+        entry = {**doc, "expires_at": time.time() + (doc["expires_at"] - datetime.utcnow()).total_seconds()}
+        self._put(key, entry)
+        return entry
+
+    def _put(self, key: str, entry: dict):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > NEGATIVE_CACHE_MAX_ENTRIES:
+                self._entries.popitem(last=False)
+
+    def record(self, endpoint: str, pk, error: str | None, status: int | None = None, detail: str = ""):
+        """Remember a failed lookup; error=None (not the account's fault) is ignored."""
+        if error is None or pk is None:
+            return
+        ttl = NEGATIVE_TTLS[error]
+        entry = {"error": error, "status": status, "detail": str(detail)[:200], "expires_at": time.time() + ttl}
+        key = self._key(endpoint, pk)
+        self._put(key, entry)
+        with self._lock:
+            self.totals["recorded"][error] = self.totals["recorded"].get(error, 0) + 1
+        shared = self._shared()
+        if shared is not None:
+            try:
+                shared.replace_one(
+                    {"_id": key},
+                    {**entry, "pk": str(pk), "expires_at": datetime.utcfromtimestamp(entry["expires_at"])},
+                    upsert=True,
+                )
+            except Exception as e:
+                print("negative cache write error:", e)
+
+    def saved(self, endpoint: str, calls: int = 1, seconds: float = 0.0):
+        """Count upstream calls (and pacing sleep) avoided thanks to a cached failure."""
+        with self._lock:
+            sc = self.totals["short_circuits"]
+            sc[endpoint] = sc.get(endpoint, 0) + 1
+            self.totals["upstream_calls_saved"] += calls
+            self.totals["sleep_seconds_saved"] += seconds
+
+    def forget(self, pk) -> int:
+        """Drop every remembered failure for a pk (e.g. an account that went public)."""
+        suffix = f":{pk}"
+        with self._lock:
+            keys = [k for k in self._entries if k.endswith(suffix)]
+            for k in keys:
+                del self._entries[k]
+        removed = len(keys)
+        shared = self._shared()
+        if shared is not None:
+            try:
+                removed = max(removed, shared.delete_many({"pk": str(pk)}).deleted_count)
+            except Exception as e:
+                print("negative cache delete error:", e)
+        return removed
+
+    def status(self) -> dict:
+        now = time.time()
+        with self._lock:
+            by_error: dict[str, int] = {}
+            for entry in self._entries.values():
+                if entry["expires_at"] > now:
+                    by_error[entry["error"]] = by_error.get(entry["error"], 0) + 1
+            totals = {**self.totals, "short_circuits": dict(self.totals["short_circuits"]), "recorded": dict(self.totals["recorded"])}
+        totals["sleep_seconds_saved"] = round(totals["sleep_seconds_saved"], 1)
+        return {
+            "backend": NEGATIVE_CACHE_BACKEND,
+            "ttl_seconds": NEGATIVE_TTLS,
+            "entries": by_error,
+            "totals": totals,
+        }
+
+
+def describe(entry: dict) -> str:
+    retry_in = max(0, int(entry["expires_at"] - time.time()))
+    status = f" {entry['status']}" if entry.get("status") else ""
+    return f"recent {entry['error']}{status} cached, retry in {retry_in}s: {entry.get('detail', '')}"
+
+
+negative_cache = NegativeCache()
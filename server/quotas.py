@@ -0,0 +1,247 @@
+# quotas.py — per-user sliding-window quotas and fair scheduling of upstream work
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from fastapi import Depends, HTTPException, Request
+from pymongo import ReturnDocument
+
+from auth import get_optional_user_id
+from db import get_collection
+from deadline import DeadlineExceeded, current_deadline
+
+
+def _parse_rate(value: str, default: tuple[int, int]) -> tuple[int, int]:
+    """Parse "limit/seconds" (e.g. "30/60")."""
+    try:
+        limit, _, seconds = value.partition("/")
+        return int(limit), int(seconds or 60)
+    except (TypeError, ValueError):
+        return default
+
+
+QUOTA_BACKEND = os.getenv("QUOTA_BACKEND", "memory")  # "memory" | "mongo"
+
+QUOTAS = {
+    "search": _parse_rate(os.getenv("QUOTA_SEARCH", "30/60"), (30, 60)),
+    "summary": _parse_rate(os.getenv("QUOTA_SUMMARY", "10/60"), (10, 60)),
+    "lookup": _parse_rate(os.getenv("QUOTA_LOOKUP", "120/60"), (120, 60)),
+    # starting background follower crawls (each may run for hours)
+    "crawl": _parse_rate(os.getenv("QUOTA_CRAWL", "10/3600"), (10, 3600)),
+}
+
+
+def _too_many(detail: str, retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+# ----------------- Quota backends -----------------
+class MemoryQuotaBackend:
+    """Exact sliding window per key, in-process. Idle keys are swept periodically."""
+
+    SWEEP_INTERVAL = 60.0
+
+    def __init__(self):
+        # key -> (window, hit timestamps)
+        self._hits: dict[str, tuple[int, deque]] = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def hit(self, key: str, limit: int, window: int) -> float | None:
+        """Record a hit; return seconds to wait if over quota (hit not recorded)."""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_sweep >= self.SWEEP_INTERVAL:
+                self._sweep(now)
+            _, q = self._hits.setdefault(key, (window, deque()))
+            while q and q[0] <= now - window:
+                q.popleft()
+            if len(q) >= limit:
+                return window - (now - q[0])
+            q.append(now)
+            return None
+
+    def _sweep(self, now: float):
+        # called with the lock held: forget keys (e.g. one per anonymous IP) with no hit left in their window
+        self._last_sweep = now
+        stale = [key for key, (window, q) in self._hits.items() if not q or q[-1] <= now - window]
+        for key in stale:
+            del self._hits[key]
+
+
+class MongoQuotaBackend:
+    """
+    Sliding-window counter shared across workers: two fixed buckets per key,
+    the previous one weighted by how much of it still overlaps the window.
+    """
+
+    def hit(self, key: str, limit: int, window: int) -> float | None:
+        collection = get_collection("quotas")
+        if collection is None:
+            return _memory_backend.hit(key, limit, window)
+        now = time.time()
+        bucket = int(now // window)
+        elapsed = (now % window) / window
+        cur_id = f"{key}:{bucket}"
+        cur = collection.find_one_and_update(
+            {"_id": cur_id},
+            {"$inc": {"n": 1}, "$setOnInsert": {"expires_at": datetime.utcfromtimestamp((bucket + 2) * window)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )["n"]
+        prev_doc = collection.find_one({"_id": f"{key}:{bucket - 1}"}, {"n": 1})
+        prev = prev_doc["n"] if prev_doc else 0
+        estimate = prev * (1 - elapsed) + cur
+        if estimate <= limit:
+            return None
+        collection.update_one({"_id": cur_id}, {"$inc": {"n": -1}})
+        if cur > limit or not prev:
+            return window * (1 - elapsed)
+        # time until enough of the previous bucket slides out of the window
+        return (estimate - limit) / prev * window
+
+
+_memory_backend = MemoryQuotaBackend()
+_mongo_backend = MongoQuotaBackend()
+
+
+def quota_hit(key: str, limit: int, window: int) -> float | None:
+    """
+    Count one hit against `key` in the QUOTA_BACKEND (shared across workers with
+    "mongo", per process otherwise); seconds to wait if over `limit` (not counted).
+    """
+    if QUOTA_BACKEND == "mongo":
+        try:
+            return _mongo_backend.hit(key, limit, window)
+        except Exception as e:
+            print("shared quota backend error, using in-process counters:", e)
+    return _memory_backend.hit(key, limit, window)
+
+
+def check_quota(scope: str, key: str):
+    """Raise 429 with Retry-After when `key` is over its `scope` quota."""
+    limit, window = QUOTAS[scope]
+    retry_after = quota_hit(f"{scope}:{key}", limit, window)
+    if retry_after is not None:
+        raise _too_many(f"Rate limit exceeded for {scope}: {limit} requests per {window}s", retry_after)
+
+
+def quota(scope: str):
+    """
+    Dependency enforcing the `scope` quota. Keyed by the authenticated user id
+    (client IP for anonymous calls); returns that key for fair scheduling.
+    """
+    def dependency(request: Request, user_id: str | None = Depends(get_optional_user_id)) -> str:
+        key = f"user:{user_id}" if user_id else f"ip:{request.client.host if request.client else 'unknown'}"
+        check_quota(scope, key)
+        return key
+    return dependency
+
+
+# ----------------- Fair scheduling -----------------
+class FairScheduler:
+    """
+    Bounded concurrency for upstream-bound work. When all slots are busy,
+    waiting users are served round-robin so one user's burst can't starve others.
+    """
+
+    def __init__(self, name: str, slots: int, max_per_user: int = 2, max_wait: float = 30.0):
+        self.name = name
+        self.slots = slots
+        self.max_per_user = max_per_user
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._free = slots
+        self._active: dict[str, int] = {}
+        self._waiting: "OrderedDict[str, deque]" = OrderedDict()
+
+    def _dispatch(self):
+        # called with the lock held
+        while self._free > 0 and self._waiting:
+            user, tickets = next(iter(self._waiting.items()))
+            ticket = tickets.popleft()
+            if tickets:
+                self._waiting.move_to_end(user)
+            else:
+                del self._waiting[user]
+            ticket["granted"] = True
+            self._free -= 1
+            self._active[user] = self._active.get(user, 0) + 1
+        self._cond.notify_all()
+
+    def _abandon(self, user: str, ticket: dict):
+        # called with the lock held: drop a ticket that gave up waiting
+        tickets = self._waiting.get(user)
+        if tickets is not None:
+            tickets.remove(ticket)
+            if not tickets:
+                del self._waiting[user]
+
+    def acquire(self, user: str):
+        """
+        Wait for a slot; returns a release() callable (idempotent). Unlike slot(),
+        the slot can outlive the calling block, e.g. handed to background work.
+        """
+        ticket = {"granted": False}
+        with self._cond:
+            pending = self._active.get(user, 0) + len(self._waiting.get(user, ()))
+            if pending >= self.max_per_user:
+                raise _too_many(f"Too many concurrent {self.name} requests", 1)
+            self._waiting.setdefault(user, deque()).append(ticket)
+            self._dispatch()
+            deadline = time.monotonic() + self.max_wait
+            # a request deadline shorter than max_wait ends the wait with DeadlineExceeded
+            request_deadline = current_deadline()
+            while not ticket["granted"]:
+                remaining = deadline - time.monotonic()
+                if request_deadline is not None and request_deadline.remaining() < remaining:
+                    remaining = request_deadline.remaining()
+                    if remaining <= 0:
+                        self._abandon(user, ticket)
+                        raise DeadlineExceeded(f"request deadline reached waiting for a {self.name} slot")
+                if remaining <= 0:
+                    self._abandon(user, ticket)
+                    raise _too_many(f"{self.name} is busy, please retry", self.max_wait / 2)
+                self._cond.wait(remaining)
+
+        def release():
+            with self._cond:
+                if ticket.get("released"):
+                    return
+                ticket["released"] = True
+                self._active[user] -= 1
+                if not self._active[user]:
+                    del self._active[user]
+                self._free += 1
+                self._dispatch()
+
+        return release
+
+    @contextmanager
+    def slot(self, user: str):
+        release = self.acquire(user)
+        try:
+            yield
+        finally:
+            release()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "slots": self.slots,
+                "free": self._free,
+                "active_users": len(self._active),
+                "waiting": sum(len(t) for t in self._waiting.values()),
+            }
+
+
+rapidapi_scheduler = FairScheduler("RapidAPI", int(os.getenv("RAPIDAPI_CONCURRENCY", 4)))
+openai_scheduler = FairScheduler("OpenAI", int(os.getenv("OPENAI_CONCURRENCY", 4)))
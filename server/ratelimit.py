@@ -0,0 +1,41 @@
+# ratelimit.py — shared accounting of upstream (RapidAPI) call volume
+import os
+import threading
+import time
+from collections import deque
+
+
+class RateBudget:
+    """
+    Sliding-window counter of calls against a budget of `limit` calls per `window` seconds.
+    Thread-safe; used to decide whether optional background work may spend calls.
+    """
+
+    def __init__(self, limit: int, window: float = 60.0):
+        self.limit = limit
+        self.window = window
+        self._calls: deque = deque()
+        self._lock = threading.Lock()
+
+    def _trim(self, now: float):
+        cutoff = now - self.window
+        while self._calls and self._calls[0] <= cutoff:
+            self._calls.popleft()
+
+    def record(self, n: int = 1):
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            self._calls.extend([now] * n)
+
+    def used(self) -> int:
+        with self._lock:
+            self._trim(time.monotonic())
+            return len(self._calls)
+
+    def remaining(self) -> int:
+        return max(0, self.limit - self.used())
+
+
+# every RapidAPI request is recorded here (foreground + background)
+RAPIDAPI_BUDGET = RateBudget(int(os.getenv("RAPIDAPI_CALLS_PER_MIN", 60)))
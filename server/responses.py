@@ -0,0 +1,193 @@
+# responses.py — fast JSON rendering, field projection and response compression
+import json
+import zlib
+from typing import Any, Iterable
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except Exception as e:
+    orjson = None
+    print("orjson not available; using stdlib json:", e)
+
+try:
+    import brotli
+except Exception:
+    brotli = None
+
+
+# ----------------- JSON -----------------
+def dumps(content: Any) -> bytes:
+    """Serialize to compact UTF-8 JSON bytes (orjson when installed)."""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """Default app response class: orjson-style rendering with a stdlib fallback."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+# ----------------- Field projection -----------------
+def parse_fields(fields: str | None) -> list[str] | None:
+    """
+    Parse a `fields=a,b,c` query value into a field list.
+    Returns None when no projection was requested (return everything).
+    """
+    if not fields:
+        return None
+    parsed = [f.strip() for f in fields.split(",") if f.strip()]
+    return parsed or None
+
+
+def project(doc: dict | None, fields: Iterable[str] | None, always: Iterable[str] = ()) -> dict | None:
+    """Keep only `fields` (plus `always`) from a result dict."""
+    if doc is None or not fields:
+        return doc
+    keep = set(fields) | set(always)
+    return {k: v for k, v in doc.items() if k in keep}
+
+
+def mongo_projection(fields: Iterable[str] | None, prefix: str = "", always: Iterable[str] = ()) -> dict:
+    """
+    Build a Mongo projection for `fields`. `prefix` targets an embedded
+    document/array (e.g. "results.") so only the requested keys are read.
+    """
+    projection: dict = {"_id": 0}
+    if not fields:
+        if prefix:
+            projection[prefix.rstrip(".")] = 1
+        return projection
+    for f in set(fields) | set(always):
+        projection[f"{prefix}{f}"] = 1
+    return projection
+
+
+# ----------------- Compression -----------------
+def _negotiate(accept_encoding: str) -> str | None:
+    """Pick `br` or `gzip` from an Accept-Encoding header, honouring q=0."""
+    accepted: dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[token] = q
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+class _Compressor:
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._c = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._c = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)  # 31 -> gzip container
+
+    def chunk(self, data: bytes) -> bytes:
+        # flush every chunk so streamed rows reach the client immediately
+        if self.encoding == "br":
+            return self._c.process(data) + self._c.flush()
+        return self._c.compress(data) + self._c.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._c.finish()
+        return self._c.flush()
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware negotiating brotli/gzip for payloads >= minimum_size.
+    Streaming responses are compressed chunk by chunk (no buffering).
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = ""
+        for name, value in scope.get("headers", []):
+            if name == b"accept-encoding":
+                accept = value.decode("latin-1")
+                break
+        encoding = _negotiate(accept) if accept else None
+        if not encoding:
+            await self.app(scope, receive, send)
+            return
+
+        state: dict = {"start": None, "compressor": None, "passthrough": False}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["start"] = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            start = state["start"]
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if start is not None:
+                # first body chunk: decide whether to compress
+                state["start"] = None
+                headers = {k.lower(): v for k, v in start.get("headers", [])}
+                if (
+                    b"content-encoding" in headers
+                    or headers.get(b"content-type", b"").startswith(b"text/event-stream")
+                    or (not more_body and len(body) < self.minimum_size)
+                ):
+                    state["passthrough"] = True
+                    await send(start)
+                    await send(message)
+                    return
+
+                compressor = _Compressor(encoding, self.gzip_level, self.brotli_quality)
+                raw = [(k, v) for k, v in start.get("headers", []) if k.lower() != b"content-length"]
+                raw.append((b"content-encoding", encoding.encode("latin-1")))
+                raw.append((b"vary", b"Accept-Encoding"))
+                if more_body:
+                    state["compressor"] = compressor
+                    await send({**start, "headers": raw})
+                    await send({"type": "http.response.body", "body": compressor.chunk(body), "more_body": True})
+                else:
+                    payload = compressor.chunk(body) + compressor.finish()
+                    raw.append((b"content-length", str(len(payload)).encode("latin-1")))
+                    await send({**start, "headers": raw})
+                    await send({"type": "http.response.body", "body": payload})
+                return
+
+            if state["passthrough"]:
+                await send(message)
+                return
+
+            compressor = state["compressor"]
+            data = compressor.chunk(body) if body else b""
+            if not more_body:
+                data += compressor.finish()
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
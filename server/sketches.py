@@ -0,0 +1,169 @@
+# sketches.py — K-minimum-values (bottom-k) sketches for audience overlap
+#
+# A sketch keeps the k smallest 64-bit hashes of an account's follower ids
+# (k=512 -> 4 KB). Sketches are mergeable, so union size, Jaccard similarity
+# and intersections of any number of accounts can be estimated from the sketches
+# alone. Cardinalities have relative error around 1/sqrt(k); an intersection
+# is estimated from the ~k*J hashes the accounts share, so its error is around
+# 1/sqrt(k*J) and grows quickly for small overlaps. Accounts with fewer than k
+# followers keep every hash, so their estimates are exact.
+
+import heapq
+import sys
+from array import array
+from itertools import combinations
+from typing import Iterable
+
+DEFAULT_K = 512
+_MASK = (1 << 64) - 1
+_SPACE = float(1 << 64)
+
+
+def hash64(x: int) -> int:
+    """splitmix64 finalizer: well-mixed 64-bit hash of an integer id."""
+    z = (x + 0x9E3779B97F4A7C15) & _MASK
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK
+    return z ^ (z >> 31)
+
+
+class KMVSketch:
+    def __init__(self, k: int = DEFAULT_K, values: Iterable[int] = ()):
+        self.k = k
+        self.values = sorted(set(values))[:k]
+        self._set = None
+
+    @classmethod
+    def from_ids(cls, ids: Iterable[int], k: int = DEFAULT_K) -> "KMVSketch":
+        """Build from a stream of ids in O(n log k) time and O(k) memory."""
+        heap: list[int] = []  # max-heap via negation
+        members: set[int] = set()
+        for i in ids:
+            h = hash64(int(i))
+            if len(heap) < k:
+                if h not in members:
+                    members.add(h)
+                    heapq.heappush(heap, -h)
+            elif h < -heap[0] and h not in members:
+                members.discard(-heapq.heappushpop(heap, -h))
+                members.add(h)
+        return cls(k, (-h for h in heap))
+
+    @property
+    def exact(self) -> bool:
+        return len(self.values) < self.k
+
+    def contains(self, value: int) -> bool:
+        if self._set is None:
+            self._set = set(self.values)
+        return value in self._set
+
+    def cardinality(self) -> float:
+        if self.exact:
+            return float(len(self.values))
+        # unbiased KMV estimator: (k - 1) / normalized k-th smallest hash
+        return (self.k - 1) / ((self.values[-1] + 1) / _SPACE)
+
+    @classmethod
+    def union(cls, sketches: list["KMVSketch"]) -> "KMVSketch":
+        k = min(s.k for s in sketches)
+        return cls(k, heapq.nsmallest(k, set().union(*(s.values for s in sketches))))
+
+    def to_bytes(self) -> bytes:
+        arr = array("Q", self.values)
+        if sys.byteorder != "little":
+            arr.byteswap()
+        return arr.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes, k: int = DEFAULT_K) -> "KMVSketch":
+        arr = array("Q")
+        arr.frombytes(bytes(data))
+        if sys.byteorder != "little":
+            arr.byteswap()
+        return cls(k, arr)
+
+
+def _all_exact(sketches: list[KMVSketch]) -> bool:
+    return all(s.exact for s in sketches)
+
+
+def _union_size(sketches: list[KMVSketch]) -> float:
+    """|A1 ∪ ... ∪ An|; exact when every sketch is (even if the union exceeds k)."""
+    if _all_exact(sketches):
+        return float(len(set().union(*(s.values for s in sketches))))
+    return KMVSketch.union(sketches).cardinality()
+
+
+def intersection(sketches: list[KMVSketch]) -> tuple[float, float, float, float | None]:
+    """
+    Estimate (|A1 ∩ ... ∩ An|, Jaccard, |A1 ∪ ... ∪ An|, relative error of the
+    intersection). The error is ~1/sqrt(shared samples) = 1/sqrt(k*J); None when
+    no sampled hash is shared (the overlap is then only known to be small).
+    Exact sketches hold every hash, so their sets are compared directly.
+    """
+    if _all_exact(sketches):
+        sets = [set(s.values) for s in sketches]
+        union = set().union(*sets)
+        if not union:
+            return 0.0, 0.0, 0.0, 0.0
+        shared = len(set.intersection(*sets))
+        return float(shared), shared / len(union), float(len(union)), 0.0
+    union = KMVSketch.union(sketches)
+    shared = sum(1 for v in union.values if all(s.contains(v) for s in sketches))
+    jaccard = shared / len(union.values)
+    size = union.cardinality()
+    error = round(1 / shared ** 0.5, 3) if shared else None
+    return jaccard * size, jaccard, size, error
+
+
+def estimate_overlap(sketches: dict[str, KMVSketch]) -> dict:
+    """Pairwise + multi-way overlap, unique combined reach and per-account exclusive reach."""
+    ids = list(sketches)
+    sizes = {i: sketches[i].cardinality() for i in ids}
+
+    pairwise = []
+    for a, b in combinations(ids, 2):
+        shared, jaccard, _, error = intersection([sketches[a], sketches[b]])
+        # independent estimates can disagree; the overlap can't exceed either audience
+        shared = min(shared, sizes[a], sizes[b])
+        pairwise.append({
+            "a": a,
+            "b": b,
+            "shared": round(shared),
+            "jaccard": round(jaccard, 4),
+            "overlap_a_percent": round(100 * shared / sizes[a], 2) if sizes[a] else 0.0,
+            "overlap_b_percent": round(100 * shared / sizes[b], 2) if sizes[b] else 0.0,
+            "relative_error": error,
+        })
+
+    all_shared, all_jaccard, unique_reach, all_error = intersection([sketches[i] for i in ids])
+    all_shared = min([all_shared] + list(sizes.values()))
+    accounts = []
+    for i in ids:
+        others = [sketches[j] for j in ids if j != i]
+        without = _union_size(others) if others else 0.0
+        accounts.append({
+            "user_id": i,
+            "estimated_followers": round(sizes[i]),
+            # followers reached by no other account in the shortlist
+            "exclusive_reach": round(max(0.0, unique_reach - without)),
+        })
+
+    total = sum(sizes.values())
+    k = min(s.k for s in sketches.values())
+    exact = _all_exact(list(sketches.values()))
+    return {
+        "accounts": accounts,
+        "pairwise": pairwise,
+        "shared_by_all": round(all_shared),
+        "jaccard_all": round(all_jaccard, 4),
+        "unique_reach": round(unique_reach),
+        "total_reach": round(total),
+        "duplicated_reach": round(max(0.0, total - unique_reach)),
+        "exact": exact,
+        # shared_by_all; each pair carries its own
+        "relative_error": all_error,
+        # reach / cardinality estimates
+        "reach_relative_error": 0.0 if exact else round(1 / (k ** 0.5), 3),
+    }
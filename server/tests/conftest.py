@@ -0,0 +1,5 @@
+import os
+import sys
+
+# server modules are imported flat (`import influencers`), as uvicorn runs them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,65 @@
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("pymongo")
+
+import influencers  # noqa: E402
+
+
+class FakeCollection:
+    """Just enough of pymongo's Collection for the search cache helpers."""
+
+    def __init__(self, docs):
+        self.docs = {d["_id"]: d for d in docs}
+
+    @staticmethod
+    def _project(doc, projection):
+        if projection is None:
+            return dict(doc)
+        # any truthy value (even just {"_id": 1}) makes it an inclusion projection
+        include = {k for k, v in projection.items() if v}
+        if include:
+            out = {k: v for k, v in doc.items() if k in include}
+        else:
+            out = {k: v for k, v in doc.items() if k not in projection}
+        if projection.get("_id", 1):
+            out["_id"] = doc["_id"]
+        return out
+
+    def find(self, query, projection=None):
+        ids = query["_id"]["$in"]
+        return [self._project(self.docs[i], projection) for i in ids if i in self.docs]
+
+    def find_one_and_update(self, query, update, projection=None):
+        for doc in self.docs.values():
+            if all(doc.get(k) == v for k, v in query.items()):
+                return self._project(doc, projection)
+        return None
+
+
+@pytest.fixture
+def collections(monkeypatch):
+    cols = {
+        "influencers": FakeCollection([
+            {"_id": "1", "pk": "1", "username": "alice", "followers": 100},
+            {"_id": "2", "pk": "2", "username": "bob", "followers": 200},
+        ]),
+        "searches": FakeCollection([
+            {"_id": "s", "keyword": "food", "limit": 10, "pks": ["2", "1", "3"]},
+        ]),
+    }
+    monkeypatch.setattr(influencers, "get_collection", cols.get)
+    return cols
+
+
+def test_default_fields_cache_hit_returns_full_rows(collections):
+    rows = influencers._load_cached_search({"keyword": "food", "limit": 10})
+    assert rows == [
+        {"pk": "2", "username": "bob", "followers": 200},
+        {"pk": "1", "username": "alice", "followers": 100},
+    ]
+
+
+def test_projected_cache_hit_keeps_pk(collections):
+    rows = influencers._load_cached_search({"keyword": "food", "limit": 10}, ["followers"])
+    assert rows == [{"pk": "2", "followers": 200}, {"pk": "1", "followers": 100}]
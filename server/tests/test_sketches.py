@@ -0,0 +1,42 @@
+import pytest
+
+from sketches import DEFAULT_K, KMVSketch, estimate_overlap, intersection
+
+
+def test_exact_small_sets():
+    a = KMVSketch.from_ids(range(0, 100))
+    b = KMVSketch.from_ids(range(60, 200))
+    report = estimate_overlap({"a": a, "b": b})
+    assert report["exact"] is True
+    assert report["shared_by_all"] == 40
+    assert report["unique_reach"] == 200
+    assert report["relative_error"] == 0.0
+    assert {x["user_id"]: x["exclusive_reach"] for x in report["accounts"]} == {"a": 60, "b": 100}
+
+
+def test_exact_sketches_whose_union_exceeds_k():
+    # each account fits in its sketch, but together they have more than k followers
+    a = KMVSketch.from_ids(range(0, 400))
+    b = KMVSketch.from_ids(range(200, 600))
+    assert a.exact and b.exact
+    shared, jaccard, union, error = intersection([a, b])
+    assert (shared, union, error) == (200.0, 600.0, 0.0)
+    assert jaccard == pytest.approx(200 / 600)
+    report = estimate_overlap({"a": a, "b": b})
+    assert report["exact"] is True
+    assert report["unique_reach"] == 600
+    assert report["shared_by_all"] == 200
+    assert {x["user_id"]: x["exclusive_reach"] for x in report["accounts"]} == {"a": 200, "b": 200}
+
+
+def test_large_audiences_stay_within_reported_error():
+    a = KMVSketch.from_ids(range(0, 200_000))
+    b = KMVSketch.from_ids(range(100_000, 300_000))
+    shared, _, union, error = intersection([a, b])
+    report = estimate_overlap({"a": a, "b": b})
+    assert report["exact"] is False
+    assert error is not None
+    # 3 sigma: fails spuriously well under 1% of the time for a fixed hash
+    assert abs(shared - 100_000) <= 3 * error * 100_000
+    assert abs(union - 300_000) <= 3 * report["reach_relative_error"] * 300_000
+    assert len(a.values) == DEFAULT_K
@@ -0,0 +1,352 @@
+# tracing.py — lightweight per-request span trees and an opt-in sampling profiler
+#
+# A request is traced when sampled (TRACE_SAMPLE_RATE) or when it sends
+# `X-Trace: 1`. Code marks regions with `with span("name", key=value):`; outside a
+# traced request span() costs one context-variable lookup. Finished traces are
+# kept in a small ring buffer (/debug/traces) and exported in the background to
+# a JSON-lines file (TRACE_JSON_PATH) and/or an OTLP/HTTP collector
+# (TRACE_OTLP_ENDPOINT, e.g. http://localhost:4318/v1/traces).
+#
+# With PROFILING_ENABLED=1, `X-Profile: 1` additionally samples the stacks of the
+# worker threads serving that request (while they are inside one of its spans;
+# never the shared event-loop thread) and attaches folded (flame-graph) stacks
+# to its trace.
+
+import json
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import requests
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0.0))
+TRACE_JSON_PATH = os.getenv("TRACE_JSON_PATH")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT")
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", 200))
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "influencer-api")
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", 5)) / 1000
+PROFILE_MAX_DEPTH = 64
+
+
+class Span:
+    __slots__ = ("span_id", "name", "attrs", "start_ns", "end_ns", "children", "error")
+
+    def __init__(self, name: str, attrs: dict):
+        self.span_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.children: list[Span] = []
+        self.error = None
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns or time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+    def to_dict(self) -> dict:
+        out = {"name": self.name, "duration_ms": round(self.duration_ms, 3)}
+        if self.attrs:
+            out["attrs"] = self.attrs
+        if self.error:
+            out["error"] = self.error
+        if self.children:
+            out["children"] = [c.to_dict() for c in self.children]
+        return out
+
+
+class Trace:
+    def __init__(self, name: str, attrs: dict):
+        self.trace_id = uuid.uuid4().hex
+        self.root = Span(name, attrs)
+        # the event-loop thread serves every request, so it is never sampled
+        self.loop_thread = threading.get_ident()
+        self.profiling = False
+        # worker thread id -> open span depth for this trace (only while profiling)
+        self.active: dict[int, int] = {}
+        self.profile: dict | None = None
+        # authenticated user the request belongs to (see tag_user)
+        self.user_id: str | None = None
+
+    def to_dict(self) -> dict:
+        out = {"trace_id": self.trace_id, "started_at": self.root.start_ns / 1e9, **self.root.to_dict()}
+        if self.user_id:
+            out["user_id"] = self.user_id
+        if self.profile:
+            out["profile"] = self.profile
+        return out
+
+
+_trace: ContextVar[Trace | None] = ContextVar("trace", default=None)
+_span: ContextVar[Span | None] = ContextVar("span", default=None)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time a region as a child of the current span; no-op outside a traced request."""
+    parent = _span.get()
+    if parent is None:
+        yield None
+        return
+    trace = _trace.get()
+    tid = None
+    if trace is not None and trace.profiling:
+        tid = threading.get_ident()
+        if tid == trace.loop_thread:
+            tid = None
+        else:
+            trace.active[tid] = trace.active.get(tid, 0) + 1
+    child = Span(name, attrs)
+    parent.children.append(child)
+    token = _span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = f"{type(e).__name__}: {e}"[:300]
+        raise
+    finally:
+        child.end_ns = time.time_ns()
+        _span.reset(token)
+        if tid is not None:
+            trace.active[tid] -= 1
+
+
+def tag_user(user_id) -> None:
+    """Record the authenticated user of the current traced request (no-op otherwise)."""
+    trace = _trace.get()
+    if trace is not None and trace.user_id is None and user_id:
+        trace.user_id = str(user_id)
+
+
+def should_trace(headers) -> bool:
+    if headers.get("x-trace") == "1" or (PROFILING_ENABLED and headers.get("x-profile") == "1"):
+        return True
+    return TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+
+
+@contextmanager
+def trace_request(name: str, profile: bool = False, **attrs):
+    """Root span for one request; exports the finished trace."""
+    trace = Trace(name, attrs)
+    t_token, s_token = _trace.set(trace), _span.set(trace.root)
+    profiler = SamplingProfiler(trace) if profile and PROFILING_ENABLED else None
+    if profiler:
+        trace.profiling = True
+        profiler.start()
+    try:
+        yield trace
+    finally:
+        trace.root.end_ns = time.time_ns()
+        if profiler:
+            trace.profile = profiler.stop()
+        _trace.reset(t_token)
+        _span.reset(s_token)
+        _exporter.submit(trace)
+
+
+class TraceMiddleware:
+    """
+    ASGI middleware tracing sampled / `X-Trace: 1` requests: adds X-Trace-Id and
+    Server-Timing to their responses. Untraced requests go straight through.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        flags = {}
+        for name, value in scope.get("headers", []):
+            if name in (b"x-trace", b"x-profile"):
+                flags[name.decode("latin-1")] = value.decode("latin-1")
+        if not should_trace(flags):
+            await self.app(scope, receive, send)
+            return
+
+        profile = flags.get("x-profile") == "1"
+        with trace_request(f"{scope['method']} {scope['path']}", profile=profile) as trace:
+
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    trace.root.attrs["status"] = message["status"]
+                    # timings so far; streaming bodies keep running into the exported trace
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-trace-id", trace.trace_id.encode("latin-1")))
+                    headers.append((b"server-timing", server_timing(trace).encode("latin-1")))
+                    message = {**message, "headers": headers}
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
+
+
+def server_timing(trace: Trace, limit: int = 8) -> str:
+    """Server-Timing header value: total plus time summed per span name."""
+    totals: Counter = Counter()
+
+    def walk(s: Span):
+        for c in s.children:
+            totals[c.name] += c.duration_ms
+            walk(c)
+
+    walk(trace.root)
+    parts = [f"total;dur={trace.root.duration_ms:.1f}"]
+    for name, ms in totals.most_common(limit):
+        token = re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+        parts.append(f'{token};dur={ms:.1f}')
+    return ", ".join(parts)
+
+
+# ----------------- Sampling profiler -----------------
+class SamplingProfiler:
+    """
+    Samples, every PROFILE_INTERVAL seconds, the worker threads currently inside
+    one of the request's spans, so pooled threads serving other requests are excluded.
+    """
+
+    def __init__(self, trace: Trace):
+        self.trace = trace
+        self.counts: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(PROFILE_INTERVAL):
+            frames = sys._current_frames()
+            for tid, depth in list(self.trace.active.items()):
+                frame = frames.get(tid) if depth > 0 else None
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < PROFILE_MAX_DEPTH:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.counts[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def stop(self) -> dict:
+        self._stop.set()
+        self._thread.join(timeout=1)
+        leaf = Counter()
+        for stack, n in self.counts.items():
+            leaf[stack.rsplit(";", 1)[-1]] += n
+        return {
+            "interval_ms": PROFILE_INTERVAL * 1000,
+            "samples": self.samples,
+            # flamegraph.pl / speedscope "folded" format
+            "folded": [f"{stack} {n}" for stack, n in self.counts.most_common(200)],
+            "top": [{"frame": f, "samples": n, "percent": round(100 * n / self.samples, 1)} for f, n in leaf.most_common(20)] if self.samples else [],
+        }
+
+
+# ----------------- Export -----------------
+def _otlp_spans(trace: Trace) -> list[dict]:
+    out = []
+
+    def walk(s: Span, parent: Span | None):
+        item = {
+            "traceId": trace.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": 2 if parent is None else 1,
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.end_ns or s.start_ns),
+            "attributes": [{"key": k, "value": {"stringValue": str(v)}} for k, v in s.attrs.items()],
+        }
+        if parent is not None:
+            item["parentSpanId"] = parent.span_id
+        if s.error:
+            item["status"] = {"code": 2, "message": s.error}
+        out.append(item)
+        for c in s.children:
+            walk(c, s)
+
+    walk(trace.root, None)
+    return out
+
+
+class TraceExporter:
+    """Keeps recent traces in memory and ships finished ones off the request path."""
+
+    def __init__(self):
+        self.recent: deque = deque(maxlen=TRACE_BUFFER_SIZE)
+        self._queue: queue.Queue = queue.Queue(maxsize=1000)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, trace: Trace):
+        self.recent.append(trace)
+        if not (TRACE_JSON_PATH or TRACE_OTLP_ENDPOINT):
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            pass  # drop rather than slow requests down
+
+    def get(self, trace_id: str) -> Trace | None:
+        for t in reversed(self.recent):
+            if t.trace_id == trace_id:
+                return t
+        return None
+
+    def _run(self):
+        while True:
+            trace = self._queue.get()
+            try:
+                if TRACE_JSON_PATH:
+                    with open(TRACE_JSON_PATH, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(trace.to_dict(), default=str) + "\n")
+                if TRACE_OTLP_ENDPOINT:
+                    payload = {"resourceSpans": [{
+                        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+                        "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": _otlp_spans(trace)}],
+                    }]}
+                    requests.post(TRACE_OTLP_ENDPOINT, json=payload, timeout=5.0)
+            except Exception as e:
+                print("trace export error:", e)
+
+
+_exporter = TraceExporter()
+
+
+def recent_traces(user_id: str | None = None) -> list[dict]:
+    """Most recent first; only `user_id`'s requests when given."""
+    return [
+        {
+            "trace_id": t.trace_id,
+            "name": t.root.name,
+            "duration_ms": round(t.root.duration_ms, 3),
+            "profiled": t.profile is not None,
+            "user_id": t.user_id,
+        }
+        for t in reversed(_exporter.recent)
+        if user_id is None or t.user_id == user_id
+    ]
+
+
+def get_trace(trace_id: str, user_id: str | None = None) -> dict | None:
+    """Full trace; None when unknown or (with `user_id`) another user's request."""
+    trace = _exporter.get(trace_id)
+    if trace is None or (user_id is not None and trace.user_id != user_id):
+        return None
+    return trace.to_dict()
@@ -0,0 +1,320 @@
+# warming.py — background cache warming driven by search history
+#
+# Every cached search carries `hits` / `last_hit_at` (bumped on each lookup).
+# Periodically we score entries by frequency with a recency decay, re-run the
+# popular searches that are about to hit their TTL, and re-enrich influencer
+# profiles referenced by popular searches before their own TTL. Work only runs
+# while upstream traffic is low and stays inside WARM_BUDGET_SHARE of the
+# RapidAPI per-minute budget.
+#
+# Every worker runs a CacheWarmer, but they coordinate through the
+# `cache_warming` collection: one elected leader does the warming, spend is
+# reserved from a shared per-interval counter, and each worker reports its
+# foreground RapidAPI usage so the idle check sees the whole deployment.
+
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from fastapi import APIRouter, Depends
+from pymongo.errors import DuplicateKeyError
+
+from auth import get_current_user
+from db import get_collection
+from influencers import refresh_search, refresh_influencer
+from ratelimit import RAPIDAPI_BUDGET, RateBudget
+
+router = APIRouter()
+
+WARM_ENABLED = os.getenv("CACHE_WARMING_ENABLED", "1") == "1"
+WARM_INTERVAL_SECONDS = int(os.getenv("WARM_INTERVAL_SECONDS", 300))
+# share of the RapidAPI per-minute budget warming may spend
+WARM_BUDGET_SHARE = float(os.getenv("WARM_BUDGET_SHARE", 0.2))
+# only warm while foreground usage is below this share of the budget
+WARM_IDLE_SHARE = float(os.getenv("WARM_IDLE_SHARE", 0.5))
+# optional UTC hour windows, e.g. "0-6,22-23" (empty = any hour)
+WARM_HOURS = os.getenv("WARM_HOURS", "")
+# warm entries expiring within this many seconds
+WARM_LOOKAHEAD_SECONDS = int(os.getenv("WARM_LOOKAHEAD_SECONDS", 60 * 60))
+WARM_HALF_LIFE_HOURS = float(os.getenv("WARM_HALF_LIFE_HOURS", 12))
+WARM_MIN_SCORE = float(os.getenv("WARM_MIN_SCORE", 1.5))
+WARM_SCAN_LIMIT = int(os.getenv("WARM_SCAN_LIMIT", 500))
+# how often each worker reports its foreground usage (and checks for its turn to warm)
+WARM_REPORT_SECONDS = int(os.getenv("WARM_REPORT_SECONDS", 15))
+
+# keep in sync with the TTL indexes in db.py
+SEARCH_TTL = timedelta(hours=24)
+INFLUENCER_TTL = timedelta(hours=48)
+
+# worst case: /profile, then get_insights' /feed + /profile, then its retry (/feed + /profile)
+CALLS_PER_PROFILE = 5
+
+# warming allowance per interval, shared by all workers (a search refresh can cost 50+ calls)
+WARM_BUDGET_LIMIT = max(1, int(RAPIDAPI_BUDGET.limit * WARM_BUDGET_SHARE * WARM_INTERVAL_SECONDS / 60))
+# warming calls over the last minute, so they don't count as foreground traffic
+_warm_recent = RateBudget(RAPIDAPI_BUDGET.limit)
+WORKER_ID = uuid.uuid4().hex
+
+
+# ----------------- Cross-worker coordination -----------------
+def _state():
+    return get_collection("cache_warming")
+
+
+def _claim_leader(owner: str) -> bool:
+    """Take or renew the warmer lease; only its holder warms."""
+    now = datetime.utcnow()
+    try:
+        _state().find_one_and_update(
+            {"_id": "leader", "$or": [{"owner": owner}, {"expires_at": {"$lt": now}}]},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=2 * WARM_INTERVAL_SECONDS)}},
+            upsert=True,
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+def _budget_bucket(now: float | None = None) -> tuple[str, datetime]:
+    bucket = int((now or time.time()) // WARM_INTERVAL_SECONDS)
+    return f"budget:{bucket}", datetime.utcfromtimestamp((bucket + 2) * WARM_INTERVAL_SECONDS)
+
+
+def _reserve(cost: int) -> bool:
+    """Atomically take `cost` calls from this interval's shared warming budget."""
+    if cost > WARM_BUDGET_LIMIT:
+        # the upsert below would accept it into an empty bucket
+        return False
+    key, expires_at = _budget_bucket()
+    try:
+        _state().find_one_and_update(
+            {"_id": key, "n": {"$lte": WARM_BUDGET_LIMIT - cost}},
+            {"$inc": {"n": cost}, "$setOnInsert": {"expires_at": expires_at}},
+            upsert=True,
+        )
+        return True
+    except DuplicateKeyError:
+        # bucket exists but has no room left
+        return False
+
+
+def _budget_used() -> int:
+    key, _ = _budget_bucket()
+    doc = _state().find_one({"_id": key}, {"n": 1})
+    return doc["n"] if doc else 0
+
+
+def _report_foreground():
+    """Publish this worker's foreground RapidAPI calls over the last minute."""
+    foreground = max(0, RAPIDAPI_BUDGET.used() - _warm_recent.used())
+    _state().update_one(
+        {"_id": f"worker:{WORKER_ID}"},
+        {"$set": {"foreground": foreground, "expires_at": datetime.utcnow() + timedelta(seconds=3 * WARM_REPORT_SECONDS)}},
+        upsert=True,
+    )
+
+
+def _foreground_calls() -> int:
+    """Foreground RapidAPI calls over the last minute across live workers."""
+    docs = _state().find({"_id": {"$regex": "^worker:"}, "expires_at": {"$gt": datetime.utcnow()}}, {"foreground": 1})
+    return sum(d.get("foreground", 0) for d in docs)
+
+
+def _in_warm_hours(now: datetime) -> bool:
+    if not WARM_HOURS.strip():
+        return True
+    for span in WARM_HOURS.split(","):
+        start, _, end = span.strip().partition("-")
+        try:
+            lo, hi = int(start), int(end or start)
+        except ValueError:
+            continue
+        if lo <= now.hour <= hi:
+            return True
+    return False
+
+
+def _score(hits: int, last_hit_at: datetime | None, now: datetime) -> float:
+    """Hit count decayed by time since the last hit (half-life WARM_HALF_LIFE_HOURS)."""
+    if not hits or not last_hit_at:
+        return 0.0
+    age_hours = max(0.0, (now - last_hit_at).total_seconds() / 3600)
+    return hits * 0.5 ** (age_hours / WARM_HALF_LIFE_HOURS)
+
+
+def plan_warming(now: datetime | None = None) -> dict:
+    """
+    Predict what is worth warming.
+    Returns {"searches": [...], "influencers": [...]} ordered by score.
+    """
+    now = now or datetime.utcnow()
+    lookahead = timedelta(seconds=WARM_LOOKAHEAD_SECONDS)
+    search_cutoff = now - SEARCH_TTL + lookahead
+    influencer_cutoff = now - INFLUENCER_TTL + lookahead
+
+    searches_collection = get_collection("searches")
+    influencers_collection = get_collection("influencers")
+    searches, hot_pks = [], {}
+    cursor = searches_collection.find(
+        {"hits": {"$gt": 0}},
+        {"_id": 0, "keyword": 1, "keyword_raw": 1, "limit": 1, "user_id": 1,
+         "hits": 1, "last_hit_at": 1, "created_at": 1, "pks": 1},
+    ).sort("last_hit_at", -1).limit(WARM_SCAN_LIMIT)
+    for doc in cursor:
+        score = _score(doc.get("hits", 0), doc.get("last_hit_at"), now)
+        if score < WARM_MIN_SCORE:
+            continue
+        created_at = doc.get("created_at")
+        if created_at and created_at <= search_cutoff:
+            searches.append({
+                "keyword": doc.get("keyword_raw") or doc["keyword"],
+                "limit": doc.get("limit", 10),
+                "user_id": doc.get("user_id"),
+                "score": round(score, 2),
+                "expires_at": created_at + SEARCH_TTL,
+            })
+        else:
+            # search itself is fresh; its profiles may still expire first
+            for pk in doc.get("pks", []):
+                hot_pks[pk] = max(hot_pks.get(pk, 0.0), score)
+
+    influencers = []
+    if hot_pks and influencers_collection is not None:
+        for doc in influencers_collection.find(
+            {"_id": {"$in": list(hot_pks)}, "updated_at": {"$lte": influencer_cutoff}},
+            {"_id": 1, "username": 1, "updated_at": 1},
+        ):
+            influencers.append({
+                "pk": doc["_id"],
+                "username": doc.get("username"),
+                "score": round(hot_pks[doc["_id"]], 2),
+                "expires_at": doc["updated_at"] + INFLUENCER_TTL,
+            })
+
+    searches.sort(key=lambda x: x["score"], reverse=True)
+    influencers.sort(key=lambda x: x["score"], reverse=True)
+    return {"searches": searches, "influencers": influencers}
+
+
+class CacheWarmer:
+    """Background thread running plan_warming + refreshes every WARM_INTERVAL_SECONDS."""
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self.last_report: dict | None = None
+        self.leader = False
+        self.totals = {"runs": 0, "warmed": 0, "skipped": 0, "calls_spent": 0}
+
+    def start(self):
+        if self._thread is not None or not WARM_ENABLED or get_collection("searches") is None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="cache-warmer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _loop(self):
+        next_run = time.monotonic() + WARM_INTERVAL_SECONDS
+        while not self._stop.wait(WARM_REPORT_SECONDS):
+            try:
+                _report_foreground()
+                if time.monotonic() >= next_run:
+                    next_run = time.monotonic() + WARM_INTERVAL_SECONDS
+                    self.leader = _claim_leader(WORKER_ID)
+                    if self.leader:
+                        self.run_once()
+            except Exception as e:
+                print("cache warming error:", e)
+
+    def _idle(self) -> bool:
+        return _foreground_calls() <= RAPIDAPI_BUDGET.limit * WARM_IDLE_SHARE
+
+    def _can_spend(self, cost: int) -> str | None:
+        """Return a skip reason, or None once `cost` calls were reserved from the shared budget."""
+        if not self._idle():
+            return "foreground traffic"
+        if cost > WARM_BUDGET_LIMIT:
+            return f"costs {cost} calls, more than the warming budget of {WARM_BUDGET_LIMIT} per interval"
+        if not _reserve(cost):
+            return "warming budget exhausted"
+        return None
+
+    def run_once(self) -> dict:
+        if not self._lock.acquire(blocking=False):
+            return {"status": "already running"}
+        try:
+            now = datetime.utcnow()
+            report = {"started_at": now, "finished_at": None, "status": "ok", "warmed": [], "skipped": []}
+            if not _in_warm_hours(now):
+                report["status"] = "outside warm hours"
+            elif not self._idle():
+                report["status"] = "deferred: foreground traffic"
+            else:
+                plan = plan_warming(now)
+                items = [("search", s, 1 + s["limit"] * CALLS_PER_PROFILE) for s in plan["searches"]]
+                items += [("influencer", i, CALLS_PER_PROFILE) for i in plan["influencers"]]
+                for kind, item, cost in items:
+                    entry = {"type": kind, **item, "cost": cost}
+                    reason = "stopped" if self._stop.is_set() else self._can_spend(cost)
+                    if reason:
+                        report["skipped"].append({**entry, "reason": reason})
+                        continue
+                    _warm_recent.record(cost)
+                    self.totals["calls_spent"] += cost
+                    try:
+                        if kind == "search":
+                            refresh_search(item["keyword"], item["limit"], item["user_id"], record_hit=False)
+                        else:
+                            refresh_influencer(item["pk"])
+                        report["warmed"].append(entry)
+                    except Exception as e:
+                        report["skipped"].append({**entry, "reason": f"error: {getattr(e, 'detail', e)}"})
+            report["finished_at"] = datetime.utcnow()
+            self.totals["runs"] += 1
+            self.totals["warmed"] += len(report["warmed"])
+            self.totals["skipped"] += len(report["skipped"])
+            self.last_report = report
+            return report
+        finally:
+            self._lock.release()
+
+
+warmer = CacheWarmer()
+
+
+@router.get("/cache/warming")
+def warming_status(current_user: dict = Depends(get_current_user)):
+    """What the warmer did last run (warmed / skipped with reasons) and running totals."""
+    shared = _state() is not None
+    return {
+        "enabled": WARM_ENABLED and get_collection("searches") is not None,
+        "interval_seconds": WARM_INTERVAL_SECONDS,
+        "worker": WORKER_ID,
+        "leader": warmer.leader,
+        "budget": {
+            "rapidapi_per_minute": RAPIDAPI_BUDGET.limit,
+            "rapidapi_used_last_minute": RAPIDAPI_BUDGET.used(),
+            "foreground_last_minute_all_workers": _foreground_calls() if shared else None,
+            "warming_per_interval": WARM_BUDGET_LIMIT,
+            "warming_used_this_interval": _budget_used() if shared else None,
+        },
+        "totals": warmer.totals,
+        "last_run": warmer.last_report,
+    }
+
+
+@router.get("/cache/warming/plan")
+def warming_plan(current_user: dict = Depends(get_current_user)):
+    """Dry run: what would be warmed next, by score."""
+    if get_collection("searches") is None:
+        return {"searches": [], "influencers": []}
+    return plan_warming()